@@ -0,0 +1,63 @@
+"""Bytes and milliseconds per output format for one rendered DICOM frame.
+
+Run from the repository root: python "Test client scripts/EncoderBenchmark.py" testdata/1-001.dcm
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+import pydicom
+
+import codec_loader
+import encoders
+import photometric
+from dicom_converter_api import render_attributes
+
+REPEAT = 20
+
+
+def measure(write):
+    buffer = io.BytesIO()
+    write(buffer)
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        buffer = io.BytesIO()
+        write(buffer)
+    return len(buffer.getvalue()), 1000 * (time.perf_counter() - start) / REPEAT
+
+
+def main(path):
+    dicom = pydicom.dcmread(path)
+    frames = photometric.to_display(dicom.pixel_array, render_attributes(dicom))[:1]
+    color = photometric.is_color(frames)
+    print(f"{path}: {frames.shape[1]}x{frames.shape[2]} {'RGB' if color else 'gray'}\n")
+
+    cases = [
+        ("jpeg (PIL, before)", lambda b: codec_loader.pil_image().fromarray(frames[0]).save(b, "JPEG", quality=95)),
+        ("png (PIL level 6, before)", lambda b: codec_loader.pil_image().fromarray(frames[0]).save(b, "PNG")),
+        ("jpeg q95", lambda b: encoders.write_jpeg(frames, color, b, {"quality": 95})),
+        ("jpeg q80", lambda b: encoders.write_jpeg(frames, color, b, {"quality": 80})),
+    ]
+    for level in (0, 1, 3, 6, 9):
+        cases.append((f"png level {level}", lambda b, level=level: encoders.write_png(
+            frames, color, b, {"png_compression": level})))
+    for strategy in ("filtered", "huffman", "rle"):
+        cases.append((f"png level 1 {strategy}", lambda b, strategy=strategy: encoders.write_png(
+            frames, color, b, {"png_compression": 1, "png_strategy": strategy})))
+    for format in ("webp", "avif"):
+        if format in encoders.supported_formats():
+            for quality in (95, 80):
+                cases.append((f"{format} q{quality}", lambda b, format=format, quality=quality: encoders.ENCODERS[
+                    format].write(frames, color, b, {"quality": quality})))
+
+    print(f"{'format':<28}{'bytes':>10}{'ms':>10}")
+    for name, write in cases:
+        size, ms = measure(write)
+        print(f"{name:<28}{size:>10}{ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "testdata/1-001.dcm")
@@ -0,0 +1,94 @@
+"""Round trip through S3Storage against moto's in-process S3: single PUT, multipart, local-file upload,
+presigned URL and an aborted (deleted) upload.
+
+Run from the repository root: pip install "moto[s3]" && python "Test client scripts/S3StorageCheck.py"
+"""
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+
+# moto refuses to start without credentials; these never leave the process
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import boto3
+import requests
+
+try:
+    from moto import mock_aws
+except ImportError:
+    # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from storage import S3Storage
+
+BUCKET = "dicom-results"
+# S3's minimum part size; outputs larger than this take the multipart path
+PART_SIZE = 5 * 1024 * 1024
+
+
+def check(name, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        check.failed = True
+
+
+check.failed = False
+
+
+def body(client, storage, key):
+    return client.get_object(Bucket=BUCKET, Key=storage.object_key(key))["Body"].read()
+
+
+@mock_aws
+def main():
+    client = boto3.client("s3")
+    client.create_bucket(Bucket=BUCKET)
+    storage = S3Storage(BUCKET, prefix="results", part_size=PART_SIZE, client=client)
+
+    # Small output: one PUT, with the content type taken from the key
+    small = b"\xff\xd8small jpeg\xff\xd9"
+    with storage.open_writer("a/output.jpeg") as writer:
+        writer.write(small)
+    check("single PUT stored", body(client, storage, "a/output.jpeg") == small)
+    head = client.head_object(Bucket=BUCKET, Key="results/a/output.jpeg")
+    check("content type set", head["ContentType"] == "image/jpeg")
+    check("exists", storage.exists("a/output.jpeg") and not storage.exists("a/missing.jpeg"))
+    check("location", storage.location("a/output.jpeg") == f"s3://{BUCKET}/results/a/output.jpeg")
+
+    # 13 MiB in uneven writes: two full parts plus a short last one
+    large = os.urandom(13 * 1024 * 1024)
+    with storage.open_writer("b/output.tiff") as writer:
+        for start in range(0, len(large), 3 * 1024 * 1024 + 17):
+            writer.write(large[start:start + 3 * 1024 * 1024 + 17])
+        check("multipart upload started", writer.upload_id is not None and len(writer.parts) == 2)
+    check("multipart stored", body(client, storage, "b/output.tiff") == large)
+
+    # Encoders that need a named file write locally, then the file is uploaded
+    with storage.local_file("c/output.mp4") as path:
+        with open(path, "wb") as f:
+            f.write(large[:PART_SIZE + 1])
+    check("local file uploaded", body(client, storage, "c/output.mp4") == large[:PART_SIZE + 1])
+    check("local scratch file removed", not os.path.exists(path))
+
+    # The presigned URL works without AWS credentials on the request
+    response = requests.get(storage.url_for("a/output.jpeg"))
+    check("presigned URL", response.status_code == 200 and response.content == small)
+
+    # A failed write aborts its multipart upload: no object and no parts left behind
+    try:
+        with storage.open_writer("d/output.tiff") as writer:
+            writer.write(large[:PART_SIZE * 2])
+            raise RuntimeError("encoder failed")
+    except RuntimeError:
+        pass
+    check("aborted upload leaves no object", not storage.exists("d/output.tiff"))
+    uploads = client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+    check("aborted upload deleted its parts", not uploads)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(1 if check.failed else 0)
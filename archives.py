@@ -0,0 +1,93 @@
+import logging
+import os
+import tarfile
+import zipfile
+
+# Offset of the "DICM" prefix in a Part 10 file, after the 128-byte preamble
+DICM_OFFSET = 128
+DICOM_EXTENSIONS = (".dcm", ".dicom", ".dic")
+
+
+class ArchiveError(ValueError):
+    """The upload is not a readable ZIP or TAR archive."""
+
+
+def _skipped(name: str) -> bool:
+    base = os.path.basename(name)
+    # The DICOMDIR index itself carries no images; resource forks and dotfiles are packaging noise
+    return not base or base.upper() == "DICOMDIR" or base.startswith(".") or "__MACOSX/" in name
+
+
+def _is_dicom(name: str, stream) -> bool:
+    """Accept .dcm-style names, and extensionless DICOMDIR members that carry the DICM prefix."""
+    if name.lower().endswith(DICOM_EXTENSIONS):
+        return True
+    # Peek instead of read so the member stream is left untouched
+    head = stream.peek(DICM_OFFSET + 4)
+    return head[DICM_OFFSET:DICM_OFFSET + 4] == b"DICM"
+
+
+def _zip_members(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or _skipped(info.filename):
+                continue
+            # Each member is decompressed on the fly as it is read
+            with archive.open(info) as member:
+                yield info.filename, member
+
+
+def _tar_members(fileobj):
+    try:
+        # "r|*" reads the archive strictly forward (no seeking), any compression
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for info in archive:
+                if not info.isfile() or _skipped(info.name):
+                    continue
+                member = archive.extractfile(info)
+                if member is None:
+                    continue
+                with member:
+                    yield info.name, member
+    except tarfile.ReadError as e:
+        raise ArchiveError(f"Unreadable archive: {e}")
+
+
+def _check_tar(fileobj):
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            archive.next()
+    except tarfile.TarError as e:
+        raise ArchiveError(f"Not a ZIP or TAR archive: {e}")
+    finally:
+        fileobj.seek(0)
+
+
+def _dicom_only(members, filename: str):
+    skipped = 0
+    for name, member in members:
+        if _is_dicom(name, member):
+            yield name, member
+        else:
+            skipped += 1
+    if skipped:
+        logging.info(f"Skipped {skipped} non-DICOM members of {filename or 'archive'}")
+
+
+def iter_dicom_members(fileobj, filename: str = ""):
+    """Yield (member name, binary stream) for each DICOM file in a ZIP or TAR archive.
+
+    Members are streamed straight out of the archive, one at a time; each stream is only
+    valid until the next member is requested. Works for DICOMDIR-style layouts whose
+    image files have no extension. Raises ArchiveError up front if the upload is neither
+    a ZIP nor a TAR (optionally gzip/bzip2/xz compressed).
+    """
+    fileobj.seek(0)
+    is_zip = zipfile.is_zipfile(fileobj)
+    fileobj.seek(0)
+    if is_zip:
+        members = _zip_members(fileobj)
+    else:
+        _check_tar(fileobj)
+        members = _tar_members(fileobj)
+    return _dicom_only(members, filename)
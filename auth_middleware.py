@@ -1,7 +1,10 @@
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
+import hmac
 import jwt
 import logging
+import time
+from auth_utils import create_result_signature
 
 SECRET_KEY = "your-secure-secret-key"
 API_KEYS = {"client1": "client1-api-key", "client2": "client2-api-key"}  # Replace with your API keys
@@ -18,6 +21,18 @@ def verify_jwt_token(token: str):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def verify_result_signature(key: str, expires: str, signature: str):
+    """Verify a signed result URL."""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=403, detail="Invalid result signature")
+    if expires < time.time():
+        raise HTTPException(status_code=403, detail="Result URL expired")
+    if not hmac.compare_digest(create_result_signature(key, expires), signature or ""):
+        raise HTTPException(status_code=403, detail="Invalid result signature")
+
+
 async def authentication_middleware(request: Request, call_next):
     """Authentication middleware to protect endpoints."""
     try:
@@ -25,6 +40,18 @@ async def authentication_middleware(request: Request, call_next):
         if request.url.path in ["/docs", "/redoc", "/authenticator","/openapi.json"]:
             return await call_next(request)
 
+        # The decoded path as routed; request.url re-parses it and cuts keys at "#" or "?"
+        path = request.scope["path"]
+
+        # Signed result URLs can be fetched without credentials (e.g. by a browser <video> tag)
+        if path.startswith("/results/") and "signature" in request.query_params:
+            verify_result_signature(
+                path[len("/results/"):],
+                request.query_params.get("expires"),
+                request.query_params.get("signature"),
+            )
+            return await call_next(request)
+
         # Check for JWT or API Key in the request headers
         auth_header = request.headers.get("Authorization")
         api_key = request.headers.get("x-api-key")
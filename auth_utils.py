@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import jwt
 from datetime import datetime, timedelta
 
@@ -13,3 +15,9 @@ def create_jwt_token(username: str):
         "iat": datetime.utcnow()
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def create_result_signature(key: str, expires: int):
+    """Sign a result key so its URL can be fetched without auth headers until it expires."""
+    message = f"{key}:{expires}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
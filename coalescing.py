@@ -0,0 +1,207 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# Lock and result files live in a directory shared by every worker on the host
+COALESCE_DIR = os.getenv("DICOM_COALESCE_DIR") or os.path.join(tempfile.gettempdir(), "dicom-converter-coalesce")
+# How long a finished result is handed to late duplicates, in seconds
+RESULT_TTL = float(os.getenv("DICOM_COALESCE_TTL", 30))
+# Remove expired lock/result files after this many executed conversions
+SWEEP_EVERY = 100
+
+# Counters: STATS_FILE holds those of exited processes, STATS_FILE.<pid> those of each live one
+STATS_FILE = "stats.json"
+_executed_since_sweep = 0
+_counts = {}
+_counts_pid = None
+_counts_lock = threading.Lock()
+
+
+def request_key(digest: str, params: dict) -> str:
+    """Key a conversion by the input bytes' hash plus its parameters."""
+    canonical = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{digest}:{canonical}".encode()).hexdigest()
+
+
+def spool_with_digest(source, directory: str, chunk_size: int = 1024 * 1024):
+    """Copy an upload to a private temp file, hashing it on the way; returns (path, sha256 hex digest)."""
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def _path(name: str) -> str:
+    os.makedirs(COALESCE_DIR, exist_ok=True)
+    return os.path.join(COALESCE_DIR, name)
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    """Hold an exclusive flock on path; other workers (and threads) block until it is released."""
+    fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _read_result(path: str):
+    try:
+        if time.time() - os.path.getmtime(path) > RESULT_TTL:
+            return None
+        with open(path) as f:
+            return json.load(f)["result"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_result(path: str, result):
+    partial_path = f"{path}.{os.getpid()}.part"
+    with open(partial_path, "w") as f:
+        json.dump({"result": result}, f)
+    os.replace(partial_path, path)
+
+
+def _bump(counter: str):
+    """Count in this process and publish its totals to its own stats file; no host-wide lock."""
+    global _counts_pid
+    with _counts_lock:
+        if _counts_pid != os.getpid():
+            # Forked from a process that had counted already; those counts are its own
+            _counts.clear()
+            _counts_pid = os.getpid()
+        _counts[counter] = _counts.get(counter, 0) + 1
+        _write_result(_path(f"{STATS_FILE}.{os.getpid()}"), dict(_counts))
+
+
+def _read_counts(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)["result"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def stats_snapshot() -> dict:
+    """Sum the per-process counters of every worker on the host.
+
+    Files of exited workers (recycled by max_requests) are folded into STATS_FILE, so the
+    directory does not grow with every restart; only this rare read takes the lock.
+    """
+    base_path = _path(STATS_FILE)
+    with _locked(_path(STATS_FILE + ".lock")):
+        totals = _read_counts(base_path)
+        exited = {}
+        for entry in os.listdir(COALESCE_DIR):
+            prefix, _, pid = entry.rpartition(".")
+            if prefix != STATS_FILE or not pid.isdigit():
+                continue
+            path = os.path.join(COALESCE_DIR, entry)
+            counts = _read_counts(path)
+            for counter, value in counts.items():
+                totals[counter] = totals.get(counter, 0) + value
+            if not _process_alive(int(pid)):
+                exited[path] = counts
+        if exited:
+            folded = _read_counts(base_path)
+            for counts in exited.values():
+                for counter, value in counts.items():
+                    folded[counter] = folded.get(counter, 0) + value
+            _write_result(base_path, folded)
+            for path in exited:
+                os.remove(path)
+    return totals
+
+
+def stats() -> dict:
+    """Host-wide counters: conversions executed, duplicates served from an in-flight or recent result."""
+    snapshot = stats_snapshot()
+    executed = snapshot.get("executed", 0)
+    coalesced = snapshot.get("coalesced", 0)
+    total = executed + coalesced
+    return {
+        "executed": executed,
+        "coalesced": coalesced,
+        "failed": snapshot.get("failed", 0),
+        "saved_ratio": round(coalesced / total, 4) if total else 0.0,
+    }
+
+
+def _sweep():
+    cutoff = time.time() - max(RESULT_TTL * 10, 300)
+    for entry in os.listdir(COALESCE_DIR):
+        if entry.startswith(STATS_FILE):
+            continue
+        path = os.path.join(COALESCE_DIR, entry)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def run_once(key: str, fn, is_valid=None):
+    """Run fn() once per key across all workers of this host and return its (JSON-serialisable) result.
+
+    Concurrent duplicates block on the key's lock while the first caller converts, then share
+    its result; duplicates arriving within RESULT_TTL get it immediately. `is_valid(result)`
+    can reject a stale result (e.g. an output that has since been deleted).
+    """
+    global _executed_since_sweep
+    result_path = _path(f"{key}.json")
+
+    result = _read_result(result_path)
+    if result is not None and (is_valid is None or is_valid(result)):
+        _bump("coalesced")
+        return result
+
+    with _locked(_path(f"{key}.lock")):
+        # Someone else may have finished while we waited for the lock
+        result = _read_result(result_path)
+        if result is not None and (is_valid is None or is_valid(result)):
+            _bump("coalesced")
+            logging.info(f"Coalesced duplicate conversion {key[:16]}")
+            return result
+
+        try:
+            result = fn()
+        except Exception:
+            _bump("failed")
+            raise
+        _write_result(result_path, result)
+        _bump("executed")
+
+    _executed_since_sweep += 1
+    if _executed_since_sweep >= SWEEP_EVERY:
+        _executed_since_sweep = 0
+        _sweep()
+    return result
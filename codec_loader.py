@@ -0,0 +1,73 @@
+import importlib
+import logging
+import time
+
+# Heavy codec modules are imported on first use instead of at API import time,
+# so a worker only pays for the encoders it actually serves.
+CODEC_MODULES = {
+    "cv2": "cv2",
+    "pil": "PIL.Image",
+    "reportlab": "reportlab.pdfgen.canvas",
+    "reportlab_utils": "reportlab.lib.utils",
+    "tifffile": "tifffile",
+}
+
+# Codecs needed to produce (or read) each format
+FORMAT_CODECS = {
+    "jpeg": ["cv2"],
+    "png": ["cv2"],
+    "webp": ["cv2", "pil"],
+    "avif": ["cv2", "pil"],
+    "pdf": ["pil", "reportlab", "reportlab_utils"],
+    "tiff": ["tifffile", "pil"],
+    "mp4": ["cv2"],
+}
+
+_loaded = {}
+
+
+def load_codec(name: str):
+    """Import a codec module on first use and return it."""
+    module = _loaded.get(name)
+    if module is None:
+        module = importlib.import_module(CODEC_MODULES[name])
+        _loaded[name] = module
+    return module
+
+
+def cv2():
+    return load_codec("cv2")
+
+
+def pil_image():
+    return load_codec("pil")
+
+
+def pdf_canvas():
+    return load_codec("reportlab")
+
+
+def pdf_image_reader():
+    return load_codec("reportlab_utils").ImageReader
+
+
+def tifffile():
+    return load_codec("tifffile")
+
+
+def preload_codecs(formats=None):
+    """Import the codecs for the given formats (all formats by default)."""
+    formats = formats or list(FORMAT_CODECS)
+    names = []
+    for fmt in formats:
+        for name in FORMAT_CODECS.get(fmt, []):
+            if name not in names:
+                names.append(name)
+
+    start = time.perf_counter()
+    for name in names:
+        try:
+            load_codec(name)
+        except ImportError as e:
+            logging.error(f"Failed to preload codec {name}: {str(e)}")
+    logging.info(f"Preloaded codecs {names} in {1000 * (time.perf_counter() - start):.0f} ms")
@@ -0,0 +1,161 @@
+import logging
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+
+from shared_pixels import attach_array, share_array, sweep_stale_segments
+
+# Number of conversion worker processes per API process; 0 runs conversions inline
+CONVERSION_WORKERS = int(os.getenv("DICOM_CONVERSION_WORKERS", 0))
+# Seconds a request waits for its task before the worker is treated as stuck
+CONVERSION_TIMEOUT = float(os.getenv("DICOM_CONVERSION_TIMEOUT", 300))
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools whose workers were terminated because a task got stuck; their other tasks were collateral
+_terminated_pools = weakref.WeakSet()
+# Runs in every worker; restores the API process state a fresh worker interpreter lacks
+_initializer = None
+_initargs = ()
+
+
+class ConversionTaskError(Exception):
+    """Picklable carrier for an HTTPException raised inside a worker process."""
+
+    def __init__(self, status_code: int, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def enabled() -> bool:
+    return CONVERSION_WORKERS > 0
+
+
+def start_pool(initializer=None, initargs=()):
+    """Start the worker processes and wait until they are up.
+
+    Workers come from a forkserver: ProcessPoolExecutor launches them on a later submit(),
+    from a request thread, and forking the multi-threaded API process there can copy a held
+    lock (e.g. a logging handler's) into the worker. initializer(*initargs) runs in every
+    worker, including those of a pool replaced after a crash.
+    """
+    global _pool, _initializer, _initargs
+    if not enabled() or _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            if initializer is not None:
+                _initializer, _initargs = initializer, initargs
+            sweep_stale_segments()
+            _pool = _create_pool()
+            # Surface a failing initializer at startup rather than on the first request
+            _pool.submit(_noop).result(timeout=CONVERSION_TIMEOUT)
+    return _pool
+
+
+def _noop():
+    return None
+
+
+def _create_pool() -> ProcessPoolExecutor:
+    pool = ProcessPoolExecutor(
+        max_workers=CONVERSION_WORKERS,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=_initializer,
+        initargs=_initargs,
+    )
+    logging.info(f"Started conversion pool with {CONVERSION_WORKERS} workers")
+    return pool
+
+
+def _replace_broken_pool(broken: ProcessPoolExecutor, terminate: bool = False):
+    """Swap in a new pool once, however many requests saw the old one break.
+
+    With terminate, the old workers are killed too: a stuck worker would otherwise hold
+    its slot (and its memory) forever. The executor cannot tell which worker runs which task,
+    and it fails every in-flight task once any worker dies, so the whole pool goes.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not broken:
+            return
+        if terminate:
+            _terminated_pools.add(broken)
+            # ProcessPoolExecutor has no public way to stop running workers before Python 3.14
+            for process in list((broken._processes or {}).values()):
+                process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+        _pool = _create_pool()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def _call(fn, *args):
+    try:
+        return fn(*args)
+    except HTTPException as e:
+        raise ConversionTaskError(e.status_code, e.detail)
+
+
+def _call_with_shared_array(fn, descriptor, *args):
+    with attach_array(descriptor) as array:
+        return _call(fn, array, descriptor.render, *args)
+
+
+def _submit(task, *args):
+    pool = start_pool()
+    try:
+        # A pool already known to be broken raises here, at submit
+        return pool.submit(task, *args).result(timeout=CONVERSION_TIMEOUT)
+    except ConversionTaskError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except TimeoutError:
+        logging.error(f"Conversion task exceeded {CONVERSION_TIMEOUT}s; restarting the conversion pool")
+        _replace_broken_pool(pool, terminate=True)
+        raise HTTPException(status_code=504, detail="Conversion timed out.")
+    except RuntimeError as e:
+        if pool in _terminated_pools:
+            # Killed (or refused at submit) along with another request's stuck task; nothing wrong with this one
+            raise HTTPException(status_code=503, detail="Conversion pool restarted; retry the request.",
+                                headers={"Retry-After": "1"})
+        if not isinstance(e, BrokenProcessPool):
+            raise
+        # A worker died (e.g. OOM-killed); replace the pool so later requests still work
+        logging.error("Conversion worker crashed; restarting the conversion pool")
+        _replace_broken_pool(pool)
+        raise HTTPException(status_code=500, detail="Conversion worker crashed.")
+
+
+def run(fn, *args):
+    """Run fn(*args) in the pool, or inline when the pool is disabled.
+
+    Blocks until the task is done; async endpoints call it through run_in_threadpool.
+
+    Arguments must be small (paths, keys, parameters); pass pixel data through run_shared.
+    """
+    if not enabled():
+        return fn(*args)
+    return _submit(_call, fn, *args)
+
+
+def run_shared(fn, array, render, *args):
+    """Run fn(array, render, *args) in the pool, handing the array over through shared memory.
+
+    Only a small descriptor is pickled; the segment is released once the task ends,
+    even if the worker crashed.
+    """
+    if not enabled():
+        return fn(array, render, *args)
+    with share_array(array, render) as descriptor:
+        return _submit(_call_with_shared_array, fn, descriptor, *args)
@@ -0,0 +1,246 @@
+import datetime
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+from pydicom.multival import MultiValue
+from pydicom.pixel_data_handlers.util import apply_color_lut
+from pydicom.uid import UID
+
+# Keys the pseudonyms, remapped UIDs and date offsets; the same secret gives the same mapping
+# on every worker and every request, so a study keeps its identity across batches.
+# Required: with a known key, original IDs could be recovered by hashing candidate values.
+DEID_SECRET = os.getenv("DICOM_DEID_SECRET", "").encode()
+# Dates are moved back by 1..DATE_SHIFT_MAX_DAYS days, the same amount for every study of a patient
+DATE_SHIFT_MAX_DAYS = int(os.getenv("DICOM_DEID_DATE_SHIFT_MAX_DAYS", 3650))
+
+REMOVE = "remove"
+EMPTY = "empty"
+PSEUDONYM = "pseudonym"
+KEEP = "keep"
+
+# Attribute actions after DICOM PS3.15 Annex E (Basic Application Level Confidentiality Profile), abridged.
+# UIDs (VR UI) and dates (VR DA/DT) are handled by VR, see Profile.dates.
+BASIC_ACTIONS = {
+    "PatientName": PSEUDONYM,
+    "PatientID": PSEUDONYM,
+    "PatientBirthDate": EMPTY,
+    "PatientSex": EMPTY,
+    "ReferringPhysicianName": EMPTY,
+    "AccessionNumber": EMPTY,
+    "StudyID": EMPTY,
+    **{keyword: REMOVE for keyword in [
+        "OtherPatientIDs", "OtherPatientIDsSequence", "OtherPatientNames", "PatientBirthName", "PatientBirthTime",
+        "PatientMotherBirthName", "PatientAddress", "PatientTelephoneNumbers", "PatientAge", "PatientSize",
+        "PatientWeight", "IssuerOfPatientID", "MedicalRecordLocator", "MilitaryRank", "BranchOfService",
+        "EthnicGroup", "Occupation", "PatientReligiousPreference", "CountryOfResidence", "RegionOfResidence",
+        "AdditionalPatientHistory", "PatientComments", "AdmittingDiagnosesDescription", "ReferencedPatientSequence",
+        "ReferringPhysicianAddress", "ReferringPhysicianTelephoneNumbers", "PhysiciansOfRecord",
+        "PerformingPhysicianName", "NameOfPhysiciansReadingStudy", "OperatorsName", "RequestingPhysician",
+        "InstitutionName", "InstitutionAddress", "InstitutionalDepartmentName", "StationName", "DeviceSerialNumber",
+        "RequestAttributesSequence", "StudyComments", "ImageComments", "TextComments", "AcquisitionComments",
+        "StudyDescription", "SeriesDescription", "ProtocolName", "PerformedProcedureStepDescription",
+    ]},
+}
+
+
+@dataclass(frozen=True)
+class Profile:
+    """A de-identification profile: per-attribute actions plus how dates, private tags and pixels are treated."""
+
+    name: str
+    actions: Dict[str, str]
+    dates: str = EMPTY  # EMPTY, "shift" or KEEP
+    remove_private: bool = True
+    # Overlay planes (groups 60xx) often carry annotations with patient details
+    remove_overlays: bool = True
+    # Burned-in text regions to black out per Modality ("*" for any): [x0, y0, x1, y1] as fractions of the image
+    masks: Dict[str, List[List[float]]] = field(default_factory=dict)
+
+
+PROFILES = {
+    "basic": Profile("basic", BASIC_ACTIONS),
+    # PS3.15 "Retain Longitudinal Temporal Information with Modified Dates Option"
+    "longitudinal": Profile("longitudinal", BASIC_ACTIONS, dates="shift"),
+}
+
+
+def _load_custom_profiles(path: Optional[str]):
+    """Merge profiles from a JSON file: {"name": {"base": "basic", "actions": {...}, "dates": ..., "masks": {...}}}."""
+    if not path:
+        return []
+    with open(path) as f:
+        definitions = json.load(f)
+    for name, definition in definitions.items():
+        base = PROFILES[definition.get("base", "basic")]
+        PROFILES[name] = replace(
+            base,
+            name=name,
+            actions={**base.actions, **definition.get("actions", {})},
+            dates=definition.get("dates", base.dates),
+            remove_private=definition.get("remove_private", base.remove_private),
+            remove_overlays=definition.get("remove_overlays", base.remove_overlays),
+            masks={**base.masks, **definition.get("masks", {})},
+        )
+    return sorted(definitions)
+
+
+_custom_profiles = _load_custom_profiles(os.getenv("DICOM_DEID_PROFILES"))
+
+
+class SecretNotConfigured(RuntimeError):
+    """De-identification was requested but DICOM_DEID_SECRET is not set."""
+
+
+def log_configuration():
+    """Log the loaded profiles and a missing secret.
+
+    Called from the API's startup rather than at import: logging before the API's basicConfig
+    would set up the root logger for stderr at WARNING and disable the log file.
+    """
+    if _custom_profiles:
+        logging.info(f"Loaded de-identification profiles from {os.getenv('DICOM_DEID_PROFILES')}: {_custom_profiles}")
+    if not DEID_SECRET:
+        logging.warning("DICOM_DEID_SECRET is not set; de-identification requests will be refused")
+
+
+def get_profile(name: Optional[str]) -> Optional[Profile]:
+    """Resolve a profile name from a request; None means no de-identification."""
+    if not name:
+        return None
+    if name not in PROFILES:
+        raise ValueError(f"Unknown de-identification profile: {name}. Available: {sorted(PROFILES)}")
+    if not DEID_SECRET:
+        raise SecretNotConfigured("De-identification is unavailable: DICOM_DEID_SECRET is not set.")
+    return PROFILES[name]
+
+
+def _digest(value: str) -> bytes:
+    return hmac.new(DEID_SECRET, value.encode(), hashlib.sha256).digest()
+
+
+@functools.lru_cache(maxsize=65536)
+def remap_uid(uid: str) -> str:
+    """Deterministic replacement UID under the 2.25 (UUID-derived) root."""
+    return f"2.25.{int.from_bytes(_digest(uid)[:16], 'big')}"
+
+
+@functools.lru_cache(maxsize=4096)
+def pseudonym(patient_id: str) -> str:
+    return f"ANON-{_digest(patient_id).hex()[:12].upper()}"
+
+
+def source_pseudonym(source: str) -> str:
+    """Stand-in for an upload's file name (which often carries the patient name), stable per name."""
+    return f"deidentified-{_digest(f'source:{source}').hex()[:16]}"
+
+
+def date_offset(patient_id: str) -> datetime.timedelta:
+    days = int.from_bytes(_digest(f"date-shift:{patient_id}")[:4], "big") % DATE_SHIFT_MAX_DAYS + 1
+    return datetime.timedelta(days=-days)
+
+
+def _shift_date(value: str, offset: datetime.timedelta) -> str:
+    """Shift the YYYYMMDD part of a DA or DT value; values without a full date are emptied."""
+    try:
+        shifted = datetime.datetime.strptime(value[:8], "%Y%m%d") + offset
+    except ValueError:
+        return ""
+    return shifted.strftime("%Y%m%d") + value[8:]
+
+
+def _map_values(value, function):
+    if isinstance(value, MultiValue):
+        return [function(str(item)) for item in value]
+    return function(str(value))
+
+
+def deidentify_dataset(dicom, profile: Profile):
+    """De-identify a dataset in place in a single walk over its elements (sequences included)."""
+    patient_id = str(dicom.get("PatientID", "") or dicom.get("PatientName", ""))
+    identity = pseudonym(patient_id)
+    offset = date_offset(patient_id)
+
+    if profile.remove_private:
+        dicom.remove_private_tags()
+    if profile.remove_overlays:
+        for tag in [tag for tag in dicom.keys() if 0x6000 <= tag.group <= 0x60FF]:
+            del dicom[tag]
+
+    def visit(dataset, element):
+        action = profile.actions.get(element.keyword)
+        if action == REMOVE:
+            del dataset[element.tag]
+        elif action == EMPTY:
+            element.value = [] if element.VR == "SQ" else ""
+        elif action == PSEUDONYM:
+            element.value = identity
+        elif action == KEEP or element.value in (None, ""):
+            return
+        elif element.VR == "UI":
+            # Registered DICOM UIDs (SOP classes, transfer syntaxes) identify nothing and stay
+            element.value = _map_values(element.value, lambda uid: remap_uid(uid) if UID(uid).is_private else uid)
+        elif element.VR in ("DA", "DT"):
+            if profile.dates == "shift":
+                element.value = _map_values(element.value, lambda value: _shift_date(value, offset))
+            elif profile.dates != KEEP:
+                element.value = ""
+
+    dicom.walk(visit)
+
+    file_meta = getattr(dicom, "file_meta", None)
+    if file_meta is not None and "MediaStorageSOPInstanceUID" in file_meta:
+        file_meta.MediaStorageSOPInstanceUID = dicom.get("SOPInstanceUID") or \
+            remap_uid(str(file_meta.MediaStorageSOPInstanceUID))
+    dicom.PatientIdentityRemoved = "YES"
+    dicom.DeidentificationMethod = f"{profile.name} (DICOM PS3.15 Annex E)"
+    return dicom
+
+
+def mask_burned_in(pixel_array: np.ndarray, dicom, profile: Profile) -> np.ndarray:
+    """Black out the profile's burned-in text regions for the dataset's modality in every frame."""
+    modality = str(dicom.get("Modality", ""))
+    regions = profile.masks.get(modality) or profile.masks.get("*")
+    if not regions:
+        if str(dicom.get("BurnedInAnnotation", "")).upper() == "YES":
+            logging.warning(f"{modality} image has burned-in annotation but profile {profile.name} masks no region")
+        return pixel_array
+    if not pixel_array.flags.writeable:
+        pixel_array = pixel_array.copy()
+    color = int(dicom.get("SamplesPerPixel", 1)) > 1
+    rows, columns = pixel_array.shape[-3:-1] if color else pixel_array.shape[-2:]
+    fill = _black_value(pixel_array, dicom)
+    for x0, y0, x1, y1 in regions:
+        row_slice = slice(int(y0 * rows), int(np.ceil(y1 * rows)))
+        column_slice = slice(int(x0 * columns), int(np.ceil(x1 * columns)))
+        if color:
+            pixel_array[..., row_slice, column_slice, :] = fill
+        else:
+            pixel_array[..., row_slice, column_slice] = fill
+    return pixel_array
+
+
+def _black_value(pixel_array: np.ndarray, dicom):
+    """The stored pixel value that displays as black under the dataset's photometric interpretation."""
+    photometric = str(dicom.get("PhotometricInterpretation", "MONOCHROME2")).strip()
+    if photometric == "MONOCHROME1":
+        return pixel_array.max()
+    if photometric in ("RGB", "YBR_ICT", "YBR_RCT"):
+        # JPEG 2000 decoders already return ICT/RCT data as RGB
+        return np.zeros(3, dtype=pixel_array.dtype)
+    if photometric.startswith("YBR"):
+        # Lowest luma with neutral chroma
+        neutral = 1 << (int(dicom.get("BitsStored", 8 * pixel_array.dtype.itemsize)) - 1)
+        return np.array([pixel_array[..., 0].min(), neutral, neutral], dtype=pixel_array.dtype)
+    if photometric == "PALETTE COLOR":
+        entries, first, _ = dicom.RedPaletteColorLookupTableDescriptor
+        indices = np.arange(first, first + (entries or 65536))
+        darkest = indices[apply_color_lut(indices, dicom).astype(np.int64).sum(axis=-1).argmin()]
+        return pixel_array.dtype.type(darkest)
+    return pixel_array.min()
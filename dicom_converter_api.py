@@ -1,21 +1,27 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
-from typing import List, Dict
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse
+from dataclasses import dataclass
+from typing import List, Dict, Optional
 import os
 import shutil
 import tempfile
 import pydicom
-from PIL import Image
-from pydicom.pixel_data_handlers.util import apply_voi_lut
 import logging
-import cv2
-from reportlab.pdfgen import canvas
-from tifffile import imwrite
-import numpy as np
-from pdf2image import convert_from_path
-from pydicom.uid import ExplicitVRLittleEndian , generate_uid
-from pydicom.dataset import Dataset
-from pdf2image import convert_from_path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import archives
+import codec_loader
+import coalescing
+import conversion_pool
+import deidentify
+import dicom_templates
+import encoders
+import metadata_index
+import windowing
+import photometric
+import result_files
+import streaming
+from storage import LocalStorage, create_storage
 from auth_middleware import authentication_middleware
 from rate_limiter import limiter
 from auth_utils import create_jwt_token
@@ -41,101 +47,234 @@ app.middleware("http")(authentication_middleware)
 
 # Temporary directory for file processing
 temp_dir = tempfile.mkdtemp()
+# With a preloading server the directory is created in the master and shared by
+# every forked worker, so only the creating process may remove it.
+temp_dir_owner_pid = os.getpid()
+
+# Conversion outputs go to the configured storage backend (local disk by default,
+# or an S3-compatible bucket shared by all replicas)
+output_storage = create_storage(default_root=os.path.join(temp_dir, "results"))
+
+# SQLite index of metadata, filled by /metadata* requests with ?index=true
+metadata_store = metadata_index.MetadataIndex()
+INDEX_PARAM_DESCRIPTION = "Also write the configured tag set (DICOM_INDEX_TAGS) into the metadata index"
+DEIDENTIFY_PARAM_DESCRIPTION = f"De-identification profile: {', '.join(deidentify.PROFILES)}"
+STREAM_PARAM_DESCRIPTION = "Stream results as they complete: ndjson or sse (Server-Sent Events), with progress heartbeats"
 
 # Helper Functions
 
 
-def decode_pixel_data(dicom):
-    """Decode pixel data, handling compressed formats correctly."""
-    try:
-        dicom.decode()  # Ensure compressed data is decoded
-        pixel_array = apply_voi_lut(dicom.pixel_array, dicom)
+# DICOM attributes a conversion worker needs to render pixels without the full dataset
+RENDER_ATTRIBUTES = [
+    "PhotometricInterpretation", "SamplesPerPixel", "BitsStored", "PixelRepresentation", "RescaleSlope",
+    "RescaleIntercept", "RescaleType", "WindowCenter", "WindowWidth", "VOILUTFunction", "VOILUTSequence",
+    "ModalityLUTSequence",
+] + photometric.PALETTE_ATTRIBUTES
 
-        # Handle floating-point pixel data
-        if pixel_array.dtype.kind == 'f':  # Check if dtype is floating-point
-            pixel_array = (255 * (pixel_array - np.min(pixel_array)) / (np.max(pixel_array) - np.min(pixel_array))).astype(np.uint8)
 
-        # Handle YBR_FULL_422 photometric interpretation
-        if dicom.PhotometricInterpretation == 'YBR_FULL_422':
-            return Image.fromarray(pixel_array, mode='YCbCr').convert('RGB')
-        else:
-            return Image.fromarray(pixel_array)
-    except Exception as e:
-        logging.error(f"Error decoding pixel data: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to decode pixel data.")
+def render_attributes(dicom) -> Dict:
+    """Collect the rendering attributes of a dataset into a small, picklable dict."""
+    return {keyword: dicom[keyword].value for keyword in RENDER_ATTRIBUTES if keyword in dicom}
+
+
+def render_pixel_array(pixel_array, render: Dict):
+    """Turn stored pixels into 8-bit display frames: windowed gray or RGB (see photometric.to_display)."""
+    return photometric.to_display(pixel_array, render)
+
+
+def window_options(window_center: Optional[float], window_width: Optional[float], window_preset: Optional[str],
+                   auto_window: bool) -> Dict:
+    """Validate the windowing query parameters of a conversion request."""
+    try:
+        return windowing.window_request(window_center, window_width, window_preset, auto_window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def encode_options(quality: int = 95, png_compression: Optional[int] = None, png_strategy: Optional[str] = None,
+                   png_filter: Optional[str] = None) -> Dict:
+    """Validate encoder options of a request; unset PNG options fall back to the configured defaults."""
+    if png_strategy and png_strategy not in encoders.PNG_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Unknown PNG strategy: {png_strategy}. "
+                                                    f"Available: {list(encoders.PNG_STRATEGIES)}")
+    if png_filter and png_filter not in encoders.PNG_FILTERS:
+        raise HTTPException(status_code=400, detail=f"Unknown PNG filter: {png_filter}. "
+                                                    f"Available: {list(encoders.PNG_FILTERS)}")
+    if png_filter and not encoders.png_filters_supported():
+        raise HTTPException(status_code=400, detail="png_filter needs OpenCV 4.10 or newer; "
+                                                    "the installed OpenCV always lets libpng choose the filter.")
+    options = {"quality": quality, "png_compression": png_compression, "png_strategy": png_strategy,
+               "png_filter": png_filter}
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def stream_options(request: Request,
+                   stream: Optional[str] = Query(None, description=STREAM_PARAM_DESCRIPTION)) -> Optional[str]:
+    """Resolve the streaming mode of a batch request (?stream= or Accept header); None for a JSON list."""
+    try:
+        return streaming.negotiate_mode(stream, request.headers.get("accept", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-def dicom_to_format(dicom_file: UploadFile, output_folder: str, format: str, quality: int = 95) -> str:
-    """Convert DICOM to the specified format."""
+def deidentify_options(
+    profile: Optional[str] = Query(None, alias="deidentify", description=DEIDENTIFY_PARAM_DESCRIPTION)
+) -> Optional[str]:
+    """Validate the de-identification profile named in a request."""
     try:
-        # Save uploaded DICOM file temporarily
-        input_path = os.path.join(output_folder, dicom_file.filename)
-        with open(input_path, "wb") as f:
-            shutil.copyfileobj(dicom_file.file, f)
-
-        # Read DICOM file
-        dicom = pydicom.dcmread(input_path, force=True)
-        pixel_array = apply_voi_lut(dicom.pixel_array, dicom)
-
-        # Normalize floating-point data if applicable
-        if pixel_array.dtype.kind == 'f':
-            pixel_array = (255 * (pixel_array - np.min(pixel_array)) / (np.max(pixel_array) - np.min(pixel_array))).astype(np.uint8)
-
-        # Log the requested format
-        logging.info(f"Converting {dicom_file.filename} to {format.upper()}")
-
-        # Handle conversions
-        if format in ["jpeg", "png"]:
-            image = decode_pixel_data(dicom)
-            output_path = os.path.join(output_folder, dicom_file.filename.replace(".dcm", f".{format}"))
-            image.save(output_path, format.upper(), quality=quality)
-
-        elif format == "pdf":
-            image = decode_pixel_data(dicom)
-            output_path = os.path.join(output_folder, dicom_file.filename.replace(".dcm", ".pdf"))
-            pdf = canvas.Canvas(output_path)
-            metadata = f"Patient Name: {dicom.get('PatientName', 'Unknown')}\nStudy Date: {dicom.get('StudyDate', 'Unknown')}\n"
-            pdf.drawString(50, 800, metadata)
-
-            # Temporary image for embedding in PDF
-            temp_image_path = os.path.join(output_folder, "temp_image.jpg")
-            image.save(temp_image_path, "JPEG")
-            pdf.drawImage(temp_image_path, 50, 600, width=500, height=500)
-            pdf.save()
-            os.remove(temp_image_path)
-
-        elif format == "tiff":
-            output_path = os.path.join(output_folder, dicom_file.filename.replace(".dcm", ".tiff"))
-            imwrite(output_path, pixel_array)
-
-        elif format == "mp4":
-            if len(pixel_array.shape) < 3 or pixel_array.shape[0] < 2:
-                raise HTTPException(status_code=400, detail="MP4 conversion requires multi-frame DICOM files.")
-
-            output_path = os.path.join(output_folder, dicom_file.filename.replace(".dcm", ".mp4"))
-            height, width = pixel_array[0].shape
-            video_writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (width, height))
-            for frame in pixel_array:
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-                video_writer.write(rgb_frame)
-            video_writer.release()
+        deidentify.get_profile(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except deidentify.SecretNotConfigured as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return profile or None
+
+
+@dataclass(frozen=True)
+class ConversionOptions:
+    """Validated rendering, encoding and de-identification options of a DICOM conversion request."""
+
+    encoding: Dict
+    # Explicit window_center/window_width or auto_window (see window_options); empty uses the dataset's own
+    window: Dict
+    deid_profile: Optional[str] = None
+
+
+def conversion_options(
+    quality: int = Query(95),
+    window_center: Optional[float] = Query(None, description="VOI window center in modality units (e.g. HU)"),
+    window_width: Optional[float] = Query(None, description="VOI window width in modality units"),
+    window_preset: Optional[str] = Query(None, description=f"Named window: {', '.join(windowing.WINDOW_PRESETS)}"),
+    auto_window: bool = Query(False, description="Pick the window from the pixel histogram percentiles"),
+    png_compression: Optional[int] = Query(None, ge=0, le=9, description="PNG zlib level (0 fastest, 9 smallest)"),
+    png_strategy: Optional[str] = Query(None, description=f"PNG zlib strategy: {', '.join(encoders.PNG_STRATEGIES)}"),
+    png_filter: Optional[str] = Query(None, description=f"PNG row filter: {', '.join(encoders.PNG_FILTERS)}"),
+    deid_profile: Optional[str] = Depends(deidentify_options),
+) -> ConversionOptions:
+    """Query parameters shared by /convert, /convert-batch and /convert-batch-archive."""
+    return ConversionOptions(
+        encoding=encode_options(quality, png_compression, png_strategy, png_filter),
+        window=window_options(window_center, window_width, window_preset, auto_window),
+        deid_profile=deid_profile,
+    )
+
+
+def validate_formats(formats: List[str]):
+    """Reject output formats no available encoder can write."""
+    supported_formats = encoders.supported_formats()
+    invalid_formats = [fmt for fmt in formats if fmt not in supported_formats]
+    if invalid_formats:
+        logging.error(f"Unsupported formats requested: {invalid_formats}")
+        raise HTTPException(status_code=400, detail=f"Unsupported formats: {invalid_formats}")
+
+
+def result_location(key: str) -> Dict:
+    """Describe where a stored output can be fetched from."""
+    return {"file_path": output_storage.location(key), "url": output_storage.url_for(key)}
+
+
+def encode_pixel_array(pixel_array, render: Dict, format: str, options: Dict, output_key: str):
+    """Render decoded pixels and write them to storage in the requested format.
+
+    Runs inline or inside a conversion worker, where pixel_array is a view of shared memory.
+    """
+    # (frames, rows, columns) gray or (frames, rows, columns, 3) RGB
+    frames = render_pixel_array(pixel_array, render)
+    color = photometric.is_color(frames)
 
+    try:
+        encoder = encoders.get_encoder(format)
+        if encoder.to_file:
+            with output_storage.local_file(output_key) as output_path:
+                encoder.write(frames, color, output_path, options)
         else:
-            logging.error(f"Unsupported format: {format}")
-            raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+            with output_storage.open_writer(output_key) as out:
+                encoder.write(frames, color, out, options)
+    except ValueError as e:
+        logging.error(f"Cannot encode {format.upper()}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def convert_spooled_dicom(input_path: str, filename: str, format: str, encoding: Dict, window: Optional[Dict],
+                          output_key: str, deid_profile: Optional[str] = None) -> str:
+    """Decode a spooled DICOM file and write it to storage under output_key."""
+    dicom = pydicom.dcmread(input_path, force=True)
+
+    # Log the requested format
+    logging.info(f"Converting {filename} to {format.upper()}")
+
+    pixel_array = dicom.pixel_array
+    profile = deidentify.get_profile(deid_profile)
+    if profile is not None:
+        # De-identify while the dataset is in memory, so the PDF text shows the pseudonym and shifted date
+        deidentify.deidentify_dataset(dicom, profile)
+        pixel_array = deidentify.mask_burned_in(pixel_array, dicom, profile)
+
+    pdf_text = f"Patient Name: {dicom.get('PatientName', 'Unknown')}\nStudy Date: {dicom.get('StudyDate', 'Unknown')}\n"
 
-        logging.info(f"Successfully converted {dicom_file.filename} to {format.upper()} at {output_path}")
-        return output_path
+    render = render_attributes(dicom)
+    render.update(window or {})
 
+    # Decoded pixels reach a conversion worker through shared memory, not pickling
+    options = {**encoding, "pdf_text": pdf_text}
+    conversion_pool.run_shared(encode_pixel_array, pixel_array, render, format, options, output_key)
+    return output_key
+
+
+def spooled_to_format(input_path: str, digest: str, filename: str, format: str, options: ConversionOptions) -> str:
+    """Convert an already spooled DICOM file, coalescing identical requests, and return the output key.
+
+    Identical requests (same bytes and options) in flight on any worker of this host are converted
+    once and share the output.
+    """
+    encoding, window, deid_profile = options.encoding, options.window, options.deid_profile
+    request_key = coalescing.request_key(
+        digest, {"format": format, "encoding": encoding, "window": window, "deidentify": deid_profile}
+    )
+    # Content-addressed: identical requests map to one object, whatever the upload was called.
+    # The key carries no file name, since names often carry patient names and the object is
+    # shared with every client that uploads the same bytes.
+    output_key = f"{request_key[:16]}/output.{format}"
+    return coalescing.run_once(
+        request_key,
+        lambda: convert_spooled_dicom(input_path, filename, format, encoding, window, output_key, deid_profile),
+        is_valid=output_storage.exists,
+    )
+
+
+def dicom_to_format(dicom_file: UploadFile, output_folder: str, format: str, options: ConversionOptions) -> str:
+    """Convert DICOM to the specified format and return the storage key of the output (see spooled_to_format)."""
+    try:
+        # Save uploaded DICOM file to a private temporary file, hashing it as it is written
+        input_path, digest = coalescing.spool_with_digest(dicom_file.file, output_folder)
+        try:
+            output_key = spooled_to_format(input_path, digest, dicom_file.filename, format, options)
+        finally:
+            os.remove(input_path)
+
+        logging.info(f"Successfully converted {dicom_file.filename} to {format.upper()} at {output_storage.location(output_key)}")
+        return output_key
+
+    except HTTPException:
+        # 400 for unencodable input, 503/504 from the conversion pool
+        raise
     except Exception as e:
         logging.error(f"Error converting {dicom_file.filename} to {format.upper()}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to convert DICOM to {format.upper()}.")
     
 
-def extract_metadata(dicom_file: UploadFile) -> Dict:
-    """Extract metadata from a DICOM file."""
+def extract_metadata(dicom_file: UploadFile, index_writer: Optional[metadata_index.IndexWriter] = None,
+                     deid_profile: Optional[str] = None) -> Dict:
+    """Extract metadata from a DICOM file, adding its configured tags to the index when a writer is given.
+
+    With a de-identification profile, both the response and the index only see de-identified values.
+    """
     try:
-        dicom = pydicom.dcmread(dicom_file.file, force=True)
+        # Only the header is needed; skip reading (and decompressing) the pixel data
+        dicom = pydicom.dcmread(dicom_file.file, force=True, stop_before_pixels=True)
+        profile = deidentify.get_profile(deid_profile)
+        if profile is not None:
+            deidentify.deidentify_dataset(dicom, profile)
         metadata = {
             "PatientName": str(dicom.get("PatientName", "Unknown")),
             "PatientID": str(dicom.get("PatientID", "Unknown")),
@@ -144,6 +283,10 @@ def extract_metadata(dicom_file: UploadFile) -> Dict:
             "StudyDescription": str(dicom.get("StudyDescription", "Unknown")),
             "Manufacturer": str(dicom.get("Manufacturer", "Unknown")),
         }
+        if index_writer is not None:
+            # The index is searchable by anyone, so a de-identified row doesn't keep the upload's name
+            source = deidentify.source_pseudonym(dicom_file.filename) if profile is not None else dicom_file.filename
+            index_writer.add(dicom, source)
         logging.info(f"Extracted metadata from {dicom_file.filename}.")
         return metadata
     except Exception as e:
@@ -167,7 +310,7 @@ async def authenticator(username: str = Form(...), password: str = Form(...)):
 async def convert_dicom(
     request: Request,
     file: UploadFile = File(...),
-    quality: int = Query(95)
+    options: ConversionOptions = Depends(conversion_options)
 ):
     """Convert a single DICOM file to the specified format."""
     # Extract form data
@@ -176,26 +319,58 @@ async def convert_dicom(
 
     # Extract `format` from form data
     format = form_data.get("format", "jpeg")  # Default to "jpeg" if not provided
-    logging.info(f"Format extracted from form data: '{format}', Quality received: '{quality}'")
+    logging.info(f"Format extracted from form data: '{format}', Quality received: '{options.encoding['quality']}'")
+    validate_formats([format])
 
-    # Validate the format
-    supported_formats = ["jpeg", "png", "pdf", "tiff", "mp4"]
-    if format not in supported_formats:
-        logging.error(f"Unsupported format requested: {format}")
-        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
-
-    # Proceed with conversion
+    # Proceed with conversion, off the event loop so the worker keeps serving other requests
     logging.info(f"Calling dicom_to_format with format: {format.upper()}")
-    output_path = dicom_to_format(file, temp_dir, format, quality)
-    logging.info(f"Conversion successful: {file.filename} to {format.upper()} at {output_path}")
-    return {"file_path": output_path}
+    output_key = await run_in_threadpool(dicom_to_format, file, temp_dir, format, options)
+    logging.info(f"Conversion successful: {file.filename} to {format.upper()} as {output_key}")
+    return result_location(output_key)
 
 
 # Additional endpoints like batch conversion and metadata...
 
+def iter_spooled_conversions(input_path: str, digest: str, name: str, formats: List[str],
+                             options: ConversionOptions):
+    """Convert one spooled DICOM file to each format in turn, yielding each output's result as it is stored."""
+    for format in formats:
+        try:
+            output_key = spooled_to_format(input_path, digest, name, format, options)
+            yield {"format": format, **result_location(output_key), "status": "success"}
+        except HTTPException as e:
+            # Capture FastAPI-specific errors
+            error_message = f"Error converting to {format.upper()}: {str(e.detail)}"
+            logging.error(f"{name}: {error_message}")
+            yield {"format": format, "status": "failed", "error": error_message}
+        except Exception as e:
+            # Capture unexpected errors
+            error_message = f"Unexpected error during {format.upper()} conversion: {str(e)}"
+            logging.error(f"{name}: {error_message}")
+            yield {"format": format, "status": "failed", "error": error_message}
+
+
+def iter_file_conversions(file: UploadFile, formats: List[str], options: ConversionOptions):
+    """Spool one uploaded file once and convert it to each format (see iter_spooled_conversions)."""
+    file.file.seek(0)
+    input_path, digest = coalescing.spool_with_digest(file.file, temp_dir)
+    try:
+        yield from iter_spooled_conversions(input_path, digest, file.filename, formats, options)
+    finally:
+        os.remove(input_path)
+
+
 @app.post("/convert-batch", response_model=List[dict])
-async def batch_convert_dicom(request: Request, files: List[UploadFile] = File(...), quality: int = 95):
-    """Batch convert multiple DICOM files to multiple formats."""
+async def batch_convert_dicom(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    options: ConversionOptions = Depends(conversion_options),
+    mode: Optional[str] = Depends(stream_options)
+):
+    """Batch convert multiple DICOM files to multiple formats.
+
+    With ?stream=ndjson|sse (or a matching Accept header) each output is streamed as it completes.
+    """
     # Extract form data
     form_data = await request.form()
     logging.info(f"Raw Request Data: {form_data}")
@@ -205,52 +380,21 @@ async def batch_convert_dicom(request: Request, files: List[UploadFile] = File(.
     if not formats:
         formats = ["jpeg"]  # Default to "jpeg" if not provided
     logging.info(f"Formats extracted from form data: {formats}")
+    validate_formats(formats)
 
-    # Validate formats
-    supported_formats = ["jpeg", "png", "pdf", "tiff", "mp4"]
-    invalid_formats = [fmt for fmt in formats if fmt not in supported_formats]
-    if invalid_formats:
-        logging.error(f"Unsupported formats requested: {invalid_formats}")
-        raise HTTPException(status_code=400, detail=f"Unsupported formats: {invalid_formats}")
+    if mode:
+        # One event per file and format, as soon as that output is stored
+        outputs = ({"input_file": file.filename, **output} for file in files
+                   for output in iter_file_conversions(file, formats, options))
+        return streaming.stream_results(outputs, mode, total=len(files) * len(formats))
 
-    # Process each file for the requested formats
-    results = []
-    for file in files:
-        file_results = {"input_file": file.filename, "outputs": []}
-        for format in formats:
-            try:
-                # Reset file pointer to ensure fresh read
-                file.file.seek(0)
-
-                # Convert the file to the specified format
-                output_path = dicom_to_format(file, temp_dir, format, quality)
-
-                # Append success result
-                file_results["outputs"].append({
-                    "format": format,
-                    "file_path": output_path,
-                    "status": "success"
-                })
-            except HTTPException as e:
-                # Capture FastAPI-specific errors
-                error_message = f"Error converting to {format.upper()}: {str(e.detail)}"
-                logging.error(error_message)
-                file_results["outputs"].append({
-                    "format": format,
-                    "status": "failed",
-                    "error": error_message
-                })
-            except Exception as e:
-                # Capture unexpected errors
-                error_message = f"Unexpected error during {format.upper()} conversion: {str(e)}"
-                logging.error(error_message)
-                file_results["outputs"].append({
-                    "format": format,
-                    "status": "failed",
-                    "error": error_message
-                })
-
-        results.append(file_results)
+    # Process each file for the requested formats (in a worker thread, like the streamed batch)
+    def convert_files():
+        return [{"input_file": file.filename,
+                 "outputs": list(iter_file_conversions(file, formats, options))}
+                for file in files]
+
+    results = await run_in_threadpool(convert_files)
 
     logging.info(f"Batch conversion completed with results: {results}")
     return results
@@ -261,57 +405,188 @@ async def batch_convert_dicom(request: Request, files: List[UploadFile] = File(.
 
 
 @app.post("/metadata", response_model=Dict)
-async def get_metadata(file: UploadFile = File(...)):
+async def get_metadata(
+    file: UploadFile = File(...),
+    index: bool = Query(False, description=INDEX_PARAM_DESCRIPTION),
+    deid_profile: Optional[str] = Depends(deidentify_options)
+):
     """Extract metadata from a single DICOM file."""
-    metadata = extract_metadata(file)
-    return metadata
+    if not index:
+        return extract_metadata(file, deid_profile=deid_profile)
+    with metadata_store.writer() as index_writer:
+        return extract_metadata(file, index_writer, deid_profile)
 
 
 @app.post("/metadata-batch", response_model=List[Dict])
-async def get_metadata_batch(files: List[UploadFile] = File(...)):
+async def get_metadata_batch(
+    files: List[UploadFile] = File(...),
+    index: bool = Query(False, description=INDEX_PARAM_DESCRIPTION),
+    deid_profile: Optional[str] = Depends(deidentify_options)
+):
     """Extract metadata from multiple DICOM files."""
     results = []
-    for file in files:
-        try:
-            metadata = extract_metadata(file)
-            results.append({"file": file.filename, "metadata": metadata})
-        except HTTPException as e:
-            results.append({"file": file.filename, "error": str(e.detail)})
+    # Index rows are written in bulk, not one transaction per file
+    with metadata_store.writer() as index_writer:
+        for file in files:
+            try:
+                metadata = extract_metadata(file, index_writer if index else None, deid_profile)
+                results.append({"file": file.filename, "metadata": metadata})
+            except HTTPException as e:
+                results.append({"file": file.filename, "error": str(e.detail)})
     return results
 
 
+@app.get("/metadata/search", response_model=Dict)
+async def search_metadata(
+    request: Request,
+    study_date_from: Optional[str] = Query(None, description="Earliest StudyDate (YYYYMMDD)"),
+    study_date_to: Optional[str] = Query(None, description="Latest StudyDate (YYYYMMDD)"),
+    limit: int = Query(100, ge=1, le=metadata_index.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0)
+):
+    """Query the metadata index without re-reading any DICOM file.
+
+    Any indexed tag keyword is a filter (e.g. ?Modality=CT&Manufacturer=GE*); `*` and `?` are wildcards.
+    """
+    reserved = {"study_date_from", "study_date_to", "limit", "offset"}
+    filters = {key: value for key, value in request.query_params.items() if key not in reserved}
+    try:
+        return metadata_store.search(filters, study_date_from, study_date_to, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# Archive ingest: a whole study as one ZIP/TAR upload
+
+# Members converted concurrently while the rest of the archive is still being read
+ARCHIVE_CONCURRENCY = int(os.getenv("DICOM_ARCHIVE_CONCURRENCY", max(conversion_pool.CONVERSION_WORKERS, 2)))
+# Archive members up to this size are buffered in memory for metadata extraction
+ARCHIVE_SPOOL_BYTES = 16 * 1024 * 1024
+
+
+def open_archive(file: UploadFile):
+    """Iterate the DICOM members of an uploaded archive, rejecting non-archives with a 400."""
+    try:
+        return archives.iter_dicom_members(file.file, file.filename)
+    except archives.ArchiveError as e:
+        logging.error(f"Rejected archive {file.filename}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def convert_archive_member(input_path: str, digest: str, name: str, formats: List[str],
+                           options: ConversionOptions) -> Dict:
+    """Convert one spooled archive member to every requested format, then drop its spool file."""
+    try:
+        return {"input_file": name, "outputs": list(iter_spooled_conversions(input_path, digest, name, formats, options))}
+    finally:
+        os.remove(input_path)
+
+
+def iter_archive_conversions(members, archive_name: str, formats: List[str], options: ConversionOptions):
+    """Spool members one at a time as they are read and convert them concurrently, yielding results as they finish.
+
+    Read-ahead is bounded, so at most 2 x ARCHIVE_CONCURRENCY members are on disk at once.
+    """
+    converted = 0
+    with ThreadPoolExecutor(max_workers=ARCHIVE_CONCURRENCY) as executor:
+        pending = set()
+        try:
+            for name, member in members:
+                input_path, digest = coalescing.spool_with_digest(member, temp_dir)
+                pending.add(executor.submit(convert_archive_member, input_path, digest, name, formats, options))
+
+                # Hand back whatever has finished, and wait when read-ahead gets too far
+                done = {future for future in pending if future.done()}
+                if len(pending) - len(done) >= ARCHIVE_CONCURRENCY * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    converted += 1
+                    yield future.result()
+        except Exception as e:
+            # A corrupt member or truncated upload ends the archive, not the members already in flight
+            logging.error(f"Error reading archive {archive_name}: {str(e)}")
+            yield {"input_file": archive_name, "status": "failed", "error": f"Error reading archive: {str(e)}"}
+
+        for future in as_completed(pending):
+            converted += 1
+            yield future.result()
+    logging.info(f"Archive conversion of {archive_name} completed: {converted} members")
+
+
+def iter_archive_metadata(members, archive_name: str, index: bool = False, deid_profile: Optional[str] = None):
+    """Extract metadata from each archive member as it is read, yielding one result per member."""
+    with metadata_store.writer() as index_writer:
+        yield from _iter_archive_metadata(members, archive_name, index_writer if index else None, deid_profile)
+
+
+def _iter_archive_metadata(members, archive_name: str, index_writer, deid_profile: Optional[str]):
+    try:
+        for name, member in members:
+            # Buffer the member so pydicom can seek; small files stay in memory
+            with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_BYTES, dir=temp_dir) as buffered:
+                shutil.copyfileobj(member, buffered)
+                buffered.seek(0)
+                try:
+                    metadata = extract_metadata(UploadFile(file=buffered, filename=name), index_writer, deid_profile)
+                    yield {"file": name, "metadata": metadata}
+                except HTTPException as e:
+                    yield {"file": name, "error": str(e.detail)}
+    except Exception as e:
+        logging.error(f"Error reading archive {archive_name}: {str(e)}")
+        yield {"file": archive_name, "error": f"Error reading archive: {str(e)}"}
+
+
+@app.post("/convert-batch-archive")
+async def batch_convert_archive(
+    request: Request,
+    file: UploadFile = File(...),
+    options: ConversionOptions = Depends(conversion_options),
+    mode: Optional[str] = Depends(stream_options)
+):
+    """Convert every DICOM file of a ZIP/TAR archive, streaming one result event per member (NDJSON by default)."""
+
+    form_data = await request.form()
+    formats = form_data.getlist("formats") or ["jpeg"]
+    logging.info(f"Archive conversion of {file.filename} to formats: {formats}")
+    validate_formats(formats)
+
+    members = open_archive(file)
+    return streaming.stream_results(iter_archive_conversions(members, file.filename, formats, options),
+                                    mode or "ndjson")
+
+
+@app.post("/metadata-batch-archive")
+async def get_metadata_batch_archive(
+    request: Request,
+    file: UploadFile = File(...),
+    index: bool = Query(False, description=INDEX_PARAM_DESCRIPTION),
+    deid_profile: Optional[str] = Depends(deidentify_options),
+    mode: Optional[str] = Depends(stream_options)
+):
+    """Extract metadata from every DICOM file of a ZIP/TAR archive, streaming one result event per member."""
+    members = open_archive(file)
+    return streaming.stream_results(iter_archive_metadata(members, file.filename, index, deid_profile),
+                                    mode or "ndjson")
+
+
 
 # Other formats ["jpeg", "pdf", "tiff", "png", "mp4"] to DICOM:
 
 
-def convert_image_to_dicom(input_path, output_path, patient_name, patient_id):
-    """Convert an image (jpeg, png, tiff) to a DICOM file."""
+def convert_image_to_dicom(input_path, output_key, template: dicom_templates.SeriesTemplate, instance_number: int = 1):
+    """Convert an image (jpeg, png, tiff) to a Secondary Capture DICOM file."""
     try:
-        image = Image.open(input_path).convert("L")  # Convert to grayscale
-        pixel_array = np.array(image)
-
-        # Create a DICOM dataset
-        dicom = Dataset()
-        dicom.PatientName = patient_name
-        dicom.PatientID = patient_id
-
-        # Set the Transfer Syntax UID (mandatory for DICOM files)
-        dicom.file_meta = Dataset()
-        dicom.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
-
-        # Add pixel data
-        dicom.Rows, dicom.Columns = pixel_array.shape
-        dicom.PixelData = pixel_array.tobytes()
-        dicom.SamplesPerPixel = 1
-        dicom.PhotometricInterpretation = "MONOCHROME2"
-        dicom.BitsAllocated = 8
-        dicom.BitsStored = 8
-        dicom.HighBit = 7
-        dicom.PixelRepresentation = 0
+        image = codec_loader.pil_image().open(input_path)
+        pixel_array = photometric.image_to_array(image)  # Gray or RGB, never throws color away
+
+        # Shared modules come from the batch template; only the pixels are packed per file
+        dicom = template.image(pixel_array, instance_number)
 
         # Save as DICOM
-        dicom.save_as(output_path)
-        logging.info(f"Successfully converted image {input_path} to DICOM {output_path}")
+        with output_storage.open_writer(output_key) as out:
+            dicom_templates.write(dicom, out)
+        logging.info(f"Successfully converted image {input_path} to DICOM {output_storage.location(output_key)}")
     except Exception as e:
         logging.error(f"Error converting image {input_path} to DICOM: {str(e)}")
         raise HTTPException(
@@ -321,47 +596,23 @@ def convert_image_to_dicom(input_path, output_path, patient_name, patient_id):
 
 
 
-def convert_pdf_to_dicom(input_path, output_path, patient_name, patient_id):
-    """Convert a PDF file to a DICOM file."""
+def convert_pdf_to_dicom(input_path, output_key, template: dicom_templates.SeriesTemplate, instance_number: int = 1,
+                         title: str = ""):
+    """Convert a PDF file to an Encapsulated PDF DICOM file."""
     try:
-        # Convert PDF to images
-        images = convert_from_path(input_path)
-        if not images:
-            raise Exception("No pages found in the PDF.")
-
-        # Take the first page as the image
-        image = images[0].convert("L")  # Convert to grayscale
-        pixel_array = np.array(image)
-
-        # Create a DICOM dataset
-        dicom = Dataset()
-        dicom.PatientName = patient_name
-        dicom.PatientID = patient_id
-
-        # Set the Transfer Syntax UID (mandatory for DICOM files)
-        dicom.file_meta = Dataset()
-        dicom.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
-
-        # Add pixel data
-        dicom.Rows, dicom.Columns = pixel_array.shape
-        dicom.PixelData = pixel_array.tobytes()
-        dicom.SamplesPerPixel = 1
-        dicom.PhotometricInterpretation = "MONOCHROME2"
-        dicom.BitsAllocated = 8
-        dicom.BitsStored = 8
-        dicom.HighBit = 7
-        dicom.PixelRepresentation = 0
+        with open(input_path, "rb") as f:
+            document = f.read()
+        if not document.startswith(b"%PDF"):
+            raise Exception("Not a PDF document.")
+
+        # The PDF is embedded as is: every page, text and vector content stays intact
+        dicom = template.pdf(document, instance_number, title=title)
 
         # Save as DICOM
-        dicom.save_as(output_path)
-        logging.info(f"Successfully converted PDF {input_path} to DICOM {output_path}")
+        with output_storage.open_writer(output_key) as out:
+            dicom_templates.write(dicom, out)
+        logging.info(f"Successfully converted PDF {input_path} to DICOM {output_storage.location(output_key)}")
 
-    except FileNotFoundError:
-        logging.error("Poppler is not installed or not in PATH.")
-        raise HTTPException(
-            status_code=500,
-            detail="PDF conversion requires Poppler. Please ensure it is installed and added to PATH."
-        )
     except Exception as e:
         logging.error(f"Error converting PDF {input_path} to DICOM: {str(e)}")
         raise HTTPException(
@@ -370,11 +621,13 @@ def convert_pdf_to_dicom(input_path, output_path, patient_name, patient_id):
         )
 
 
-def convert_video_to_dicom(input_path, output_path, patient_name, patient_id):
-    """Convert a video file (e.g., MP4) to a DICOM file."""
+def convert_video_to_dicom(input_path, output_key, template: dicom_templates.SeriesTemplate, instance_number: int = 1):
+    """Convert a video file (e.g., MP4) to a multi-frame Secondary Capture DICOM file."""
     try:
         # Open the video file using OpenCV
+        cv2 = codec_loader.cv2()
         video_capture = cv2.VideoCapture(input_path)
+        fps = video_capture.get(cv2.CAP_PROP_FPS) or 10
         frames = []
 
         # Read video frames
@@ -382,41 +635,21 @@ def convert_video_to_dicom(input_path, output_path, patient_name, patient_id):
             ret, frame = video_capture.read()
             if not ret:
                 break
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            frames.append(gray_frame)
+            frames.append(frame)
+        video_capture.release()
 
         if not frames:
             raise Exception("No frames extracted from the video.")
 
-        # Create a DICOM dataset
-        dicom = Dataset()
-        dicom.PatientName = patient_name
-        dicom.PatientID = patient_id
-
-        # Set the Transfer Syntax UID (mandatory for DICOM files)
-        dicom.file_meta = Dataset()
-        dicom.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
-        dicom.file_meta.MediaStorageSOPClassUID = generate_uid()
-        dicom.file_meta.MediaStorageSOPInstanceUID = generate_uid()
-        dicom.file_meta.ImplementationClassUID = generate_uid()
-
-        # Add pixel data for all frames
-        pixel_array = np.stack(frames, axis=0)  # Stack frames into a 3D array
-        dicom.Rows, dicom.Columns = pixel_array.shape[1], pixel_array.shape[2]
-        dicom.NumberOfFrames = len(frames)
-        dicom.PixelData = pixel_array.tobytes()
-        dicom.SamplesPerPixel = 1
-        dicom.PhotometricInterpretation = "MONOCHROME2"
-        dicom.BitsAllocated = 8
-        dicom.BitsStored = 8
-        dicom.HighBit = 7
-        dicom.PixelRepresentation = 0
+        # All frames: RGB, or MONOCHROME2 when the video is gray; Frame Time keeps the playback rate
+        pixel_array = photometric.bgr_frames_to_array(frames)
+        dicom = template.image(pixel_array, instance_number, frame_time=1000.0 / fps)
 
         # Save as DICOM
-        dicom.save_as(output_path)
-        video_capture.release()
+        with output_storage.open_writer(output_key) as out:
+            dicom_templates.write(dicom, out)
 
-        logging.info(f"Successfully converted video {input_path} to DICOM {output_path}")
+        logging.info(f"Successfully converted video {input_path} to DICOM {output_storage.location(output_key)}")
     except FileNotFoundError:
         logging.error("Video file not found.")
         raise HTTPException(
@@ -431,6 +664,40 @@ def convert_video_to_dicom(input_path, output_path, patient_name, patient_id):
         )
 
 
+def convert_file_to_dicom(input_path: str, input_format: str, output_key: str,
+                          template: dicom_templates.SeriesTemplate, instance_number: int = 1, title: str = ""):
+    """Dispatch one input file to its to-DICOM converter."""
+    if input_format in ["jpeg", "png", "tiff"]:
+        convert_image_to_dicom(input_path, output_key, template, instance_number)
+    elif input_format == "pdf":
+        convert_pdf_to_dicom(input_path, output_key, template, instance_number, title)
+    elif input_format == "mp4":
+        conversion_pool.run(convert_video_to_dicom, input_path, output_key, template, instance_number)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported input format: {input_format}")
+
+
+def upload_to_dicom(file: UploadFile, input_format: str, template: dicom_templates.SeriesTemplate,
+                    position: int = 1, instance_number: int = 1) -> str:
+    """Convert an uploaded file into an instance of the template's study and return its storage key.
+
+    `position` is the file's place in the upload; `instance_number` counts within its series.
+    """
+    # Each upload gets its own key inside the study, so equal upload names never overwrite each other
+    output_key = f"{template.study_uid}/{position:04d}.dcm"
+
+    # A private spool file (keeping the extension for the decoders), removed once converted
+    fd, input_path = tempfile.mkstemp(dir=temp_dir, suffix=os.path.splitext(file.filename or "")[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+        title = os.path.splitext(os.path.basename(file.filename or ""))[0]
+        convert_file_to_dicom(input_path, input_format, output_key, template, instance_number, title)
+    finally:
+        os.remove(input_path)
+    return output_key
+
+
 
 
 
@@ -444,22 +711,10 @@ async def convert_to_dicom(
     patient_id: str = Query("000000")
 ):
     try:
-        temp_input_path = os.path.join(temp_dir, file.filename)
-        with open(temp_input_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-
-        output_dicom_path = os.path.join(temp_dir, file.filename.replace(f".{input_format}", ".dcm"))
+        template = dicom_templates.SeriesTemplate(patient_name, patient_id)
+        output_dicom_key = await run_in_threadpool(upload_to_dicom, file, input_format, template)
 
-        if input_format in ["jpeg", "png", "tiff"]:
-            convert_image_to_dicom(temp_input_path, output_dicom_path, patient_name, patient_id)
-        elif input_format == "pdf":
-            convert_pdf_to_dicom(temp_input_path, output_dicom_path, patient_name, patient_id)
-        elif input_format == "mp4":
-            convert_video_to_dicom(temp_input_path, output_dicom_path, patient_name, patient_id)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported input format: {input_format}")
-
-        return {"file_path": output_dicom_path}
+        return result_location(output_dicom_key)
     except HTTPException as e:
         # Pass through HTTP exceptions
         logging.error(f"HTTP Error: {str(e)}")
@@ -472,73 +727,147 @@ async def convert_to_dicom(
 
 
 
+def convert_batch_file_to_dicom(file: UploadFile, input_format: str, template: dicom_templates.SeriesTemplate,
+                                position: int, instance_number: int) -> Dict:
+    """Convert one file of a to-DICOM batch, capturing failures in its result."""
+    file_result = {
+        "input_file": file.filename,
+        "input_format": input_format,
+        "status": "pending",
+        "output_file": None,
+        "error": None
+    }
+
+    try:
+        # Spool, convert based on format, and store as this file's instance of the batch
+        output_dicom_key = upload_to_dicom(file, input_format, template, position, instance_number)
+
+        # Update result on success
+        file_result["status"] = "success"
+        file_result["output_file"] = output_storage.location(output_dicom_key)
+        file_result["url"] = output_storage.url_for(output_dicom_key)
+    except HTTPException as e:
+        # Update result on HTTP exception
+        file_result["status"] = "failed"
+        file_result["error"] = e.detail
+    except Exception as e:
+        # Update result on general exception
+        file_result["status"] = "failed"
+        file_result["error"] = str(e)
+
+    return file_result
+
+
 @app.post("/convert-to-dicom-batch", response_model=List[dict])
 async def batch_convert_to_dicom(
+    request: Request,
     files: List[UploadFile] = File(...),
     input_formats: List[str] = Query(..., description="Input formats corresponding to each file (e.g., jpeg, png, pdf, tiff, mp4)"),
     patient_name: str = Query("Anonymous"),
-    patient_id: str = Query("000000")
+    patient_id: str = Query("000000"),
+    mode: Optional[str] = Depends(stream_options)
 ):
     """
-    Batch convert multiple files into DICOM format.
+    Batch convert multiple files into DICOM format, as one study: images and videos in one
+    Secondary Capture series, PDFs in one Encapsulated PDF series.
+
+    With ?stream=ndjson|sse (or a matching Accept header) each file's result is streamed as it completes.
     """
-    results = []
     if len(files) != len(input_formats):
         raise HTTPException(
             status_code=400,
             detail="The number of files and input formats must match."
         )
 
-    for file, input_format in zip(files, input_formats):
-        file_result = {
-            "input_file": file.filename,
-            "input_format": input_format,
-            "status": "pending",
-            "output_file": None,
-            "error": None
-        }
+    # One study for the whole batch; instances numbered in upload order within each series
+    template = dicom_templates.SeriesTemplate(patient_name, patient_id)
+    numbers = dicom_templates.instance_numbers(input_formats)
+    results = (convert_batch_file_to_dicom(file, input_format, template, position, instance_number)
+               for position, (file, input_format, instance_number)
+               in enumerate(zip(files, input_formats, numbers), start=1))
+    if mode:
+        return streaming.stream_results(results, mode, total=len(files))
+    return await run_in_threadpool(list, results)
 
-        try:
-            # Save the uploaded file temporarily
-            temp_input_path = os.path.join(temp_dir, file.filename)
-            with open(temp_input_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-
-            # Define the output DICOM file path
-            output_dicom_path = os.path.join(temp_dir, file.filename.replace(f".{input_format}", ".dcm"))
-
-            # Call the appropriate conversion function based on format
-            if input_format in ["jpeg", "png", "tiff"]:
-                convert_image_to_dicom(temp_input_path, output_dicom_path, patient_name, patient_id)
-            elif input_format == "pdf":
-                convert_pdf_to_dicom(temp_input_path, output_dicom_path, patient_name, patient_id)
-            elif input_format == "mp4":
-                convert_video_to_dicom(temp_input_path, output_dicom_path, patient_name, patient_id)
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported input format: {input_format}")
-
-            # Update result on success
-            file_result["status"] = "success"
-            file_result["output_file"] = output_dicom_path
-        except HTTPException as e:
-            # Update result on HTTP exception
-            file_result["status"] = "failed"
-            file_result["error"] = e.detail
-        except Exception as e:
-            # Update result on general exception
-            file_result["status"] = "failed"
-            file_result["error"] = str(e)
 
-        results.append(file_result)
+# Result download
 
-    return results
+@app.api_route("/results/{key:path}", methods=["GET", "HEAD"])
+async def get_result(key: str, request: Request):
+    """Serve a stored conversion output (signed URL or authenticated request).
+
+    Local outputs support byte ranges (resume, video seeking) and ETag/Last-Modified revalidation.
+    """
+    if not isinstance(output_storage, LocalStorage):
+        # Object storage serves the bytes itself; hand out a fresh presigned URL
+        return RedirectResponse(output_storage.url_for(key))
+    try:
+        path = output_storage.path_for(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid result key: {key}")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Result not found: {key}")
+    return result_files.file_response(key, path, request.headers, send_body=request.method != "HEAD")
+
+
+# Metrics
+
+@app.get("/metrics/coalescing", response_model=Dict)
+async def coalescing_metrics():
+    """Host-wide counts of conversions executed and of duplicates served from another request's result."""
+    return coalescing.stats()
+
+
+# Worker warm-up and temp folder cleanup
+
+@app.on_event("startup")
+def log_deidentification_configuration():
+    deidentify.log_configuration()
 
 
-# Temp folder cleanup
+@app.on_event("startup")
+def warm_up_codecs():
+    """Preload codec modules in each worker after fork (DICOM_PRELOAD_CODECS=all or jpeg,png,...)."""
+    preload = os.getenv("DICOM_PRELOAD_CODECS", "").strip()
+    if not preload:
+        return
+    formats = None if preload == "all" else [fmt.strip() for fmt in preload.split(",") if fmt.strip()]
+    codec_loader.preload_codecs(formats)
+
+
+@app.on_event("startup")
+def start_conversion_pool():
+    """Start conversion workers (DICOM_CONVERSION_WORKERS > 0)."""
+    # Only local storage depends on this process (its temp root); S3 is rebuilt from the environment
+    local_storage = output_storage if isinstance(output_storage, LocalStorage) else None
+    conversion_pool.start_pool(initializer=init_conversion_worker, initargs=(local_storage,))
+
+
+def init_conversion_worker(storage: Optional[LocalStorage]):
+    """Conversion worker initializer: write outputs where this API process serves them from.
+
+    Workers start from a fresh interpreter that imported this module itself, creating its own
+    temp dir, and without the codecs warmed up in the API process.
+    """
+    global output_storage
+    warm_up_codecs()
+    if storage is None:
+        return
+    if temp_dir_owner_pid == os.getpid():
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    output_storage = storage
+
+
+@app.on_event("shutdown")
+def stop_conversion_pool():
+    conversion_pool.shutdown_pool()
+
 
 @app.on_event("shutdown")
 def cleanup_temp_dir():
     """Clean up temporary files on shutdown."""
+    if os.getpid() != temp_dir_owner_pid:
+        return
     if os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)
         logging.info("Temporary directory cleaned up.")
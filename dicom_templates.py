@@ -0,0 +1,141 @@
+import copy
+import datetime
+from typing import List, Optional
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import (
+    PYDICOM_IMPLEMENTATION_UID,
+    EncapsulatedPDFStorage,
+    ExplicitVRLittleEndian,
+    MultiFrameGrayscaleByteSecondaryCaptureImageStorage,
+    MultiFrameTrueColorSecondaryCaptureImageStorage,
+    SecondaryCaptureImageStorage,
+    generate_uid,
+)
+
+import photometric
+
+IMPLEMENTATION_VERSION_NAME = "DICOMCONV_1"
+# Images and encapsulated documents go to separate series of the same study (Modality is per series)
+SERIES_NUMBERS = {"OT": 1, "DOC": 2}
+# Series (by Modality) each to-DICOM input format lands in
+INPUT_MODALITIES = {"jpeg": "OT", "png": "OT", "tiff": "OT", "mp4": "OT", "pdf": "DOC"}
+
+
+def instance_numbers(input_formats: List[str]) -> List[int]:
+    """Instance Numbers for a batch in upload order, counted from 1 within each series.
+
+    Unsupported formats get 0; they fail before any instance is written.
+    """
+    counters = {}
+    numbers = []
+    for input_format in input_formats:
+        modality = INPUT_MODALITIES.get(input_format)
+        if modality is None:
+            numbers.append(0)
+            continue
+        counters[modality] = counters.get(modality, 0) + 1
+        numbers.append(counters[modality])
+    return numbers
+
+
+class SeriesTemplate:
+    """Attributes shared by every instance of a to-DICOM batch, built once per batch.
+
+    All instances get the same Patient, Study and Equipment modules, one Study Instance UID,
+    and the Series Instance UID of their modality; only the SOP Common, Instance Number,
+    and pixel (or document) attributes are filled in per file.
+    """
+
+    def __init__(self, patient_name: str, patient_id: str, study_uid: Optional[str] = None):
+        now = datetime.datetime.now()
+        self.study_uid = study_uid or generate_uid()
+        # Derived from the study UID so a worker process builds the same series UIDs
+        self.series_uids = {
+            modality: generate_uid(entropy_srcs=[self.study_uid, modality]) for modality in SERIES_NUMBERS
+        }
+
+        dicom = Dataset()
+        dicom.SpecificCharacterSet = "ISO_IR 192"
+        dicom.InstanceCreationDate = dicom.StudyDate = dicom.ContentDate = now.strftime("%Y%m%d")
+        dicom.InstanceCreationTime = dicom.StudyTime = dicom.ContentTime = now.strftime("%H%M%S")
+        # Patient
+        dicom.PatientName = patient_name
+        dicom.PatientID = patient_id
+        dicom.PatientBirthDate = ""
+        dicom.PatientSex = ""
+        # General Study
+        dicom.StudyInstanceUID = self.study_uid
+        dicom.StudyID = ""
+        dicom.AccessionNumber = ""
+        dicom.ReferringPhysicianName = ""
+        # General Equipment and SC Equipment: created on a workstation from non-DICOM input
+        dicom.Manufacturer = ""
+        dicom.ConversionType = "WSD"
+        self.dataset = dicom
+
+    def instance(self, sop_class_uid: str, modality: str, instance_number: int) -> Dataset:
+        """A new dataset for one instance of the batch, with file meta ready for writing."""
+        # Copy the elements, not just the dict that holds them, so the template is never modified
+        dicom = Dataset({tag: copy.copy(element) for tag, element in self.dataset.items()})
+        dicom.SOPClassUID = sop_class_uid
+        dicom.SOPInstanceUID = generate_uid()
+        dicom.Modality = modality
+        dicom.SeriesInstanceUID = self.series_uids[modality]
+        dicom.SeriesNumber = SERIES_NUMBERS[modality]
+        dicom.InstanceNumber = instance_number
+
+        dicom.file_meta = FileMetaDataset()
+        dicom.file_meta.MediaStorageSOPClassUID = sop_class_uid
+        dicom.file_meta.MediaStorageSOPInstanceUID = dicom.SOPInstanceUID
+        dicom.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        dicom.file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+        dicom.file_meta.ImplementationVersionName = IMPLEMENTATION_VERSION_NAME
+        dicom.is_little_endian = True
+        dicom.is_implicit_VR = False
+        return dicom
+
+    def image(self, pixel_array: np.ndarray, instance_number: int, frame_time: Optional[float] = None) -> Dataset:
+        """Secondary Capture instance for one gray/RGB image, or a multi-frame one for a frame stack."""
+        multi_frame = frame_time is not None
+        color = pixel_array.ndim == (4 if multi_frame else 3)
+        if not multi_frame:
+            sop_class_uid = SecondaryCaptureImageStorage
+        elif color:
+            sop_class_uid = MultiFrameTrueColorSecondaryCaptureImageStorage
+        else:
+            sop_class_uid = MultiFrameGrayscaleByteSecondaryCaptureImageStorage
+
+        dicom = self.instance(sop_class_uid, "OT", instance_number)
+        dicom.PatientOrientation = ""
+        dicom.BurnedInAnnotation = "NO"
+        if multi_frame:
+            dicom.NumberOfFrames = len(pixel_array)
+            dicom.FrameTime = round(frame_time, 3)
+            dicom.FrameIncrementPointer = pydicom.tag.Tag("FrameTime")
+        if multi_frame and not color:
+            # Required by the Multi-frame Grayscale Byte SC module; single-frame SC has no such attribute
+            dicom.PresentationLUTShape = "IDENTITY"
+        photometric.set_pixel_data(dicom, pixel_array, color=color)
+        return dicom
+
+    def pdf(self, document: bytes, instance_number: int, title: str = "") -> Dataset:
+        """Encapsulated PDF instance embedding the document as is."""
+        dicom = self.instance(EncapsulatedPDFStorage, "DOC", instance_number)
+        dicom.DocumentTitle = title
+        dicom.ConceptNameCodeSequence = Sequence()
+        dicom.AcquisitionDateTime = ""
+        dicom.BurnedInAnnotation = "YES"
+        dicom.MIMETypeOfEncapsulatedDocument = "application/pdf"
+        dicom.EncapsulatedDocumentLength = len(document)
+        # OB values have even length; the pad byte sits after the PDF's %%EOF marker
+        dicom.EncapsulatedDocument = document + b"\0" * (len(document) % 2)
+        return dicom
+
+
+def write(dicom: Dataset, out):
+    """Write preamble, file meta and dataset to a binary stream in one sequential pass."""
+    pydicom.dcmwrite(out, dicom, write_like_original=False)
@@ -0,0 +1,199 @@
+import functools
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+import codec_loader
+
+# PNG defaults: zlib level 1 with the RLE strategy encodes 512x512 CT slices about 2x faster than
+# PIL's level 6 at the same or smaller size (see "Test client scripts/EncoderBenchmark.py")
+PNG_COMPRESSION = int(os.getenv("DICOM_PNG_COMPRESSION", 1))
+PNG_STRATEGY = os.getenv("DICOM_PNG_STRATEGY", "rle")
+# Encoder threads for OpenCV (colour conversion, AVIF) and Pillow's AVIF encoder; 0 keeps library defaults
+ENCODER_THREADS = int(os.getenv("DICOM_ENCODER_THREADS", 0))
+
+PNG_STRATEGIES = {
+    "default": "IMWRITE_PNG_STRATEGY_DEFAULT",
+    "filtered": "IMWRITE_PNG_STRATEGY_FILTERED",
+    "huffman": "IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY",
+    "rle": "IMWRITE_PNG_STRATEGY_RLE",
+    "fixed": "IMWRITE_PNG_STRATEGY_FIXED",
+}
+# Row filters need OpenCV >= 4.10 (see png_filters_supported); older builds always use libpng's adaptive choice
+PNG_FILTERS = {
+    "none": "IMWRITE_PNG_FILTER_NONE",
+    "sub": "IMWRITE_PNG_FILTER_SUB",
+    "up": "IMWRITE_PNG_FILTER_UP",
+    "avg": "IMWRITE_PNG_FILTER_AVG",
+    "paeth": "IMWRITE_PNG_FILTER_PAETH",
+    "fast": "IMWRITE_PNG_FAST_FILTERS",
+    "all": "IMWRITE_PNG_ALL_FILTERS",
+}
+
+
+@dataclass(frozen=True)
+class Encoder:
+    """An output format: how to write rendered frames and what it needs from storage."""
+
+    format: str
+    media_type: str
+    # write(frames, color, target, options): target is a binary stream, or a path when to_file is set
+    write: Callable
+    # Writer needs a real file (it seeks back, or picks the container from the extension)
+    to_file: bool = False
+    available: Callable[[], bool] = lambda: True
+
+
+@functools.lru_cache(maxsize=None)
+def _configure_threads():
+    if ENCODER_THREADS > 0:
+        codec_loader.cv2().setNumThreads(ENCODER_THREADS)
+
+
+@functools.lru_cache(maxsize=None)
+def _cv2_can_write(extension: str) -> bool:
+    try:
+        return bool(codec_loader.cv2().haveImageWriter(f"x{extension}"))
+    except Exception:
+        return False
+
+
+def _pil_can_write(format: str) -> bool:
+    image_module = codec_loader.pil_image()
+    image_module.init()
+    return format.upper() in image_module.SAVE
+
+
+def _bgr(frame: np.ndarray, color: bool) -> np.ndarray:
+    cv2 = codec_loader.cv2()
+    return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) if color else frame
+
+
+def _imencode(extension: str, frame: np.ndarray, color: bool, params: List[int]) -> memoryview:
+    _configure_threads()
+    ok, encoded = codec_loader.cv2().imencode(extension, _bgr(frame, color), params)
+    if not ok:
+        raise ValueError(f"OpenCV could not encode {extension[1:].upper()}")
+    # Hand the encoder's buffer to the writer without another copy
+    return memoryview(encoded)
+
+
+def _pil_save(frame: np.ndarray, target, format: str, **params):
+    image = codec_loader.pil_image().fromarray(frame)
+    image.save(target, format, **params)
+
+
+def write_jpeg(frames, color, target, options):
+    # OpenCV encodes through libjpeg-turbo (SIMD) straight from the NumPy array
+    cv2 = codec_loader.cv2()
+    target.write(_imencode(".jpg", frames[0], color, [cv2.IMWRITE_JPEG_QUALITY, int(options.get("quality", 95))]))
+
+
+def png_params(compression: Optional[int] = None, strategy: Optional[str] = None,
+               filter: Optional[str] = None) -> List[int]:
+    cv2 = codec_loader.cv2()
+    params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION if compression is None else int(compression)]
+    params += [cv2.IMWRITE_PNG_STRATEGY, getattr(cv2, PNG_STRATEGIES[strategy or PNG_STRATEGY])]
+    if filter:
+        params += [cv2.IMWRITE_PNG_FILTER, getattr(cv2, PNG_FILTERS[filter])]
+    return params
+
+
+@functools.lru_cache(maxsize=None)
+def png_filters_supported() -> bool:
+    """Whether the installed OpenCV lets callers pick the PNG row filter."""
+    return hasattr(codec_loader.cv2(), "IMWRITE_PNG_FILTER")
+
+
+def write_png(frames, color, target, options):
+    params = png_params(options.get("png_compression"), options.get("png_strategy"), options.get("png_filter"))
+    target.write(_imencode(".png", frames[0], color, params))
+
+
+def write_webp(frames, color, target, options):
+    quality = int(options.get("quality", 95))
+    if _cv2_can_write(".webp"):
+        target.write(_imencode(".webp", frames[0], color, [codec_loader.cv2().IMWRITE_WEBP_QUALITY, quality]))
+    else:
+        _pil_save(frames[0], target, "WEBP", quality=quality, method=4)
+
+
+def write_avif(frames, color, target, options):
+    quality = int(options.get("quality", 95))
+    if _cv2_can_write(".avif"):
+        cv2 = codec_loader.cv2()
+        target.write(_imencode(".avif", frames[0], color, [cv2.IMWRITE_AVIF_QUALITY, quality, cv2.IMWRITE_AVIF_SPEED, 8]))
+    else:
+        threads = {"max_threads": ENCODER_THREADS} if ENCODER_THREADS > 0 else {}
+        _pil_save(frames[0], target, "AVIF", quality=quality, speed=8, **threads)
+
+
+def write_pdf(frames, color, target, options):
+    # invariant: no creation date or random document ID, so equal inputs give byte-identical files
+    pdf = codec_loader.pdf_canvas().Canvas(target, invariant=1)
+    pdf.drawString(50, 800, options.get("pdf_text", ""))
+
+    # Embed the image directly, without a temporary JPEG on disk
+    image = codec_loader.pil_image().fromarray(frames[0])
+    pdf.drawImage(codec_loader.pdf_image_reader()(image), 50, 600, width=500, height=500)
+    pdf.save()
+
+
+def write_tiff(frames, color, target, options):
+    codec_loader.tifffile().imwrite(
+        target, frames[0] if len(frames) == 1 else frames, photometric="rgb" if color else "minisblack"
+    )
+
+
+def write_mp4(frames, color, target, options):
+    if len(frames) < 2:
+        raise ValueError("MP4 conversion requires multi-frame DICOM files.")
+
+    _configure_threads()
+    cv2 = codec_loader.cv2()
+    frame_count, height, width = frames.shape[:3]
+    if color:
+        # Convert the whole stack to BGR in one call instead of per frame
+        frames = cv2.cvtColor(frames.reshape(frame_count * height, width, 3), cv2.COLOR_RGB2BGR).reshape(frames.shape)
+    # Gray frames go straight to the encoder without a GRAY2BGR copy
+    video_writer = cv2.VideoWriter(target, cv2.VideoWriter_fourcc(*"mp4v"), 10, (width, height), color)
+    for frame in frames:
+        video_writer.write(frame)
+    video_writer.release()
+
+
+ENCODERS = {
+    encoder.format: encoder for encoder in [
+        Encoder("jpeg", "image/jpeg", write_jpeg),
+        Encoder("png", "image/png", write_png),
+        Encoder("webp", "image/webp", write_webp,
+                available=lambda: _cv2_can_write(".webp") or _pil_can_write("WEBP")),
+        Encoder("avif", "image/avif", write_avif,
+                available=lambda: _cv2_can_write(".avif") or _pil_can_write("AVIF")),
+        Encoder("pdf", "application/pdf", write_pdf),
+        # tifffile seeks back to patch offsets, so it needs a real file
+        Encoder("tiff", "image/tiff", write_tiff, to_file=True),
+        Encoder("mp4", "video/mp4", write_mp4, to_file=True),
+    ]
+}
+
+
+@functools.lru_cache(maxsize=None)
+def supported_formats() -> Tuple[str, ...]:
+    """Formats whose codec libraries are present in this build, checked once per process."""
+    formats = []
+    for format, encoder in ENCODERS.items():
+        if encoder.available():
+            formats.append(format)
+        else:
+            logging.info(f"{format.upper()} output disabled: no encoder available")
+    return tuple(formats)
+
+
+def get_encoder(format: str) -> Encoder:
+    if format not in supported_formats():
+        raise ValueError(f"Unsupported format: {format}")
+    return ENCODERS[format]
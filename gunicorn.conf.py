@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+
+# Production launch profile:
+#   gunicorn -c gunicorn.conf.py dicom_converter_api:app
+# SIGHUP restarts the workers gracefully. With preload_app they are forked from the
+# master's already imported app, so new code is only picked up with PRELOAD_APP=0
+# or a USR2 + WINCH + QUIT binary upgrade (see README, Production Deployment).
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity (a container's cpuset), capped by a cgroup v2
+    CPU quota (docker --cpus), instead of every CPU of the host."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # No sched_getaffinity on macOS and Windows
+        cpus = multiprocessing.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+# One worker per core by default; conversions are CPU bound, so more workers
+# than cores only adds memory and context switches.
+workers = int(os.getenv("WEB_CONCURRENCY", available_cpus()))
+
+# Import the app once in the master and fork workers from it. Codecs are
+# warmed up per worker after fork (see DICOM_PRELOAD_CODECS). Set PRELOAD_APP=0
+# where deploys reload code with SIGHUP.
+preload_app = os.getenv("PRELOAD_APP", "1").lower() not in ("0", "false", "no")
+
+# Without preload every worker imports the app and creates its own temp dir, so the default
+# local results root would differ per worker: a result URL served by another worker would 404,
+# coalesced requests could not reuse each other's outputs and each worker would delete its own
+# results on exit. Outputs then need a root (or bucket) shared by all workers.
+if not preload_app and os.getenv("DICOM_STORAGE_BACKEND", "local").lower() == "local" \
+        and not os.getenv("DICOM_STORAGE_ROOT"):
+    raise RuntimeError("PRELOAD_APP=0 requires DICOM_STORAGE_ROOT (or DICOM_STORAGE_BACKEND=s3).")
+
+# Recycle workers after N requests to cap memory growth from decoded pixel data
+max_requests = int(os.getenv("MAX_REQUESTS", 500))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", 50))
+
+# Large batches can take a while; give in-flight requests time to finish on reload
+timeout = int(os.getenv("WORKER_TIMEOUT", 300))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 60))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_exit(server):
+    """Remove the shared temp directory created by the preloaded app."""
+    if not preload_app:
+        # Each worker created and removed its own temp directory
+        return
+    import dicom_converter_api
+
+    dicom_converter_api.cleanup_temp_dir()
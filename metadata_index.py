@@ -0,0 +1,165 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from pydicom.datadict import keyword_dict
+from pydicom.multival import MultiValue
+
+# Always indexed: the identifiers and filters most queries start from
+INDEXED_TAGS = ["PatientID", "StudyInstanceUID", "SeriesInstanceUID", "Modality", "StudyDate"]
+DEFAULT_TAGS = INDEXED_TAGS + [
+    "PatientName", "SOPInstanceUID", "SOPClassUID", "AccessionNumber", "StudyDescription", "SeriesDescription",
+    "SeriesNumber", "InstanceNumber", "BodyPartExamined", "Manufacturer", "ManufacturerModelName", "Rows", "Columns",
+]
+
+INDEX_PATH = os.getenv("DICOM_INDEX_PATH", "dicom_metadata_index.db")
+# Rows are inserted with one executemany per batch
+BATCH_SIZE = int(os.getenv("DICOM_INDEX_BATCH_SIZE", 500))
+MAX_PAGE_SIZE = 1000
+
+
+def configured_tags() -> List[str]:
+    """Tag keywords to index: DICOM_INDEX_TAGS (comma-separated) plus the always-indexed ones."""
+    requested = [tag.strip() for tag in os.getenv("DICOM_INDEX_TAGS", "").split(",") if tag.strip()]
+    tags = list(INDEXED_TAGS)
+    for tag in requested or DEFAULT_TAGS:
+        # Keywords become column names, so only genuine DICOM keywords are accepted
+        if tag not in keyword_dict:
+            raise ValueError(f"Unknown DICOM keyword in DICOM_INDEX_TAGS: {tag}")
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def _value(dicom, keyword: str) -> Optional[str]:
+    value = dicom.get(keyword)
+    if value is None or value == "":
+        return None
+    if isinstance(value, MultiValue):
+        return "\\".join(str(item) for item in value)
+    return str(value)
+
+
+class MetadataIndex:
+    """SQLite index of DICOM header values, one row per SOP instance (latest upload wins)."""
+
+    def __init__(self, path: str = INDEX_PATH, tags: Optional[List[str]] = None):
+        self.path = path
+        self.tags = tags or configured_tags()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork; each worker opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+            self._create_schema()
+        return self._connection
+
+    def _create_schema(self):
+        connection = self._connection
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS instances (instance_key TEXT PRIMARY KEY, source TEXT, indexed_at REAL)"
+        )
+        existing = {row[1] for row in connection.execute("PRAGMA table_info(instances)")}
+        for tag in self.tags:
+            # A changed DICOM_INDEX_TAGS adds columns; rows indexed earlier have NULL there
+            if tag not in existing:
+                connection.execute(f'ALTER TABLE instances ADD COLUMN "{tag}" TEXT')
+        for tag in INDEXED_TAGS:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "ix_instances_{tag}" ON instances ("{tag}")')
+        connection.commit()
+
+    def row_for(self, dicom, source: str) -> tuple:
+        """Build an index row from a dataset; instances without a SOPInstanceUID are keyed by their source."""
+        values = [_value(dicom, tag) for tag in self.tags]
+        instance_key = _value(dicom, "SOPInstanceUID") or f"source:{source}"
+        return (instance_key, source, time.time(), *values)
+
+    def add_many(self, rows: List[tuple]):
+        """Insert or replace rows in a single transaction."""
+        if not rows:
+            return
+        columns = ", ".join(["instance_key", "source", "indexed_at"] + [f'"{tag}"' for tag in self.tags])
+        placeholders = ", ".join("?" * (3 + len(self.tags)))
+        with self._lock:
+            with self.connection:
+                self.connection.executemany(f"INSERT OR REPLACE INTO instances ({columns}) VALUES ({placeholders})", rows)
+        logging.info(f"Indexed metadata of {len(rows)} DICOM instances")
+
+    def writer(self) -> "IndexWriter":
+        return IndexWriter(self)
+
+    def search(self, filters: Dict[str, str], study_date_from: Optional[str] = None,
+               study_date_to: Optional[str] = None, limit: int = 100, offset: int = 0) -> Dict:
+        """Filter indexed instances: exact matches, `*`/`?` wildcards, and a StudyDate range (YYYYMMDD)."""
+        clauses, parameters = [], []
+        for tag, value in filters.items():
+            if tag not in self.tags:
+                raise ValueError(f"{tag} is not an indexed tag. Indexed tags: {self.tags}")
+            if "*" in value or "?" in value:
+                # DICOM query wildcards; GLOB keeps matching case-sensitive like DICOM matching
+                clauses.append(f'"{tag}" GLOB ?')
+            else:
+                clauses.append(f'"{tag}" = ?')
+            parameters.append(value)
+        if study_date_from:
+            clauses.append('"StudyDate" >= ?')
+            parameters.append(study_date_from)
+        if study_date_to:
+            clauses.append('"StudyDate" <= ?')
+            parameters.append(study_date_to)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        columns = ", ".join(["source", "indexed_at"] + [f'"{tag}"' for tag in self.tags])
+        with self._lock:
+            connection = self.connection
+            total = connection.execute(f"SELECT COUNT(*) FROM instances {where}", parameters).fetchone()[0]
+            rows = connection.execute(
+                f'SELECT {columns} FROM instances {where} ORDER BY "StudyDate", "StudyInstanceUID", '
+                f'"SeriesInstanceUID", instance_key LIMIT ? OFFSET ?',
+                parameters + [limit, offset],
+            ).fetchall()
+        names = ["source", "indexed_at"] + self.tags
+        return {
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "results": [{name: value for name, value in zip(names, row) if value is not None} for row in rows],
+        }
+
+
+class IndexWriter:
+    """Collects index rows and flushes them in batches of BATCH_SIZE (and on exit)."""
+
+    def __init__(self, index: MetadataIndex):
+        self.index = index
+        self.rows = []
+
+    def add(self, dicom, source: str):
+        if not any(_value(dicom, tag) for tag in ["SOPInstanceUID"] + INDEXED_TAGS):
+            # Read with force=True, a non-DICOM upload parses to an empty header; don't index it
+            logging.info(f"Not indexing {source}: no DICOM identifiers found")
+            return
+        self.rows.append(self.index.row_for(dicom, source))
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        rows, self.rows = self.rows, []
+        self.index.add_many(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.flush()
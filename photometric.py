@@ -0,0 +1,156 @@
+from typing import Dict
+
+import numpy as np
+from pydicom.dataset import Dataset
+from pydicom.pixel_data_handlers.util import apply_color_lut, convert_color_space
+
+import codec_loader
+import windowing
+
+MONOCHROME = ("MONOCHROME1", "MONOCHROME2")
+
+# JPEG 2000 decoders undo the ICT/RCT multi-component transform themselves,
+# so these arrive as RGB
+DECODED_AS_RGB = ("RGB", "YBR_ICT", "YBR_RCT")
+
+# Attributes describing a palette, needed to expand PALETTE COLOR pixels
+PALETTE_ATTRIBUTES = [
+    "RedPaletteColorLookupTableDescriptor", "GreenPaletteColorLookupTableDescriptor",
+    "BluePaletteColorLookupTableDescriptor", "RedPaletteColorLookupTableData", "GreenPaletteColorLookupTableData",
+    "BluePaletteColorLookupTableData", "SegmentedRedPaletteColorLookupTableData",
+    "SegmentedGreenPaletteColorLookupTableData", "SegmentedBluePaletteColorLookupTableData",
+]
+
+# Channels that differ by at most this much are treated as gray (lossy codecs add chroma noise)
+GRAY_TOLERANCE = 4
+
+
+def frame_stack(pixel_array: np.ndarray, samples_per_pixel: int = 1) -> np.ndarray:
+    """View pixel data as a stack of frames: (frames, rows, columns[, samples])."""
+    single_frame_ndim = 2 if samples_per_pixel == 1 else 3
+    if pixel_array.ndim == single_frame_ndim:
+        return pixel_array[np.newaxis]
+    return pixel_array
+
+
+def is_color(stack: np.ndarray) -> bool:
+    return stack.ndim == 4
+
+
+def _to_uint8(pixel_array: np.ndarray, bits_stored: int) -> np.ndarray:
+    if pixel_array.dtype == np.uint8:
+        return pixel_array
+    shift = max(int(bits_stored) - 8, 0)
+    return (pixel_array >> shift).astype(np.uint8)
+
+
+def _ybr_full_to_rgb(stack: np.ndarray) -> np.ndarray:
+    """YBR_FULL (full-range BT.601) to RGB for a whole frame stack in one OpenCV call."""
+    cv2 = codec_loader.cv2()
+    frames, rows, columns, _ = stack.shape
+    # OpenCV expects Y, Cr, Cb; reshaping the stack into one tall image keeps it to a single call
+    ycrcb = np.ascontiguousarray(stack[..., [0, 2, 1]]).reshape(frames * rows, columns, 3)
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB).reshape(stack.shape)
+
+
+def _ybr_partial_to_rgb(stack: np.ndarray) -> np.ndarray:
+    """YBR_PARTIAL_420/422 (limited-range BT.601) to RGB."""
+    ybr = stack.astype(np.float32)
+    y = (ybr[..., 0] - 16.0) * 1.164
+    cb = ybr[..., 1] - 128.0
+    cr = ybr[..., 2] - 128.0
+    rgb = np.empty(stack.shape, dtype=np.float32)
+    rgb[..., 0] = y + 1.596 * cr
+    rgb[..., 1] = y - 0.392 * cb - 0.813 * cr
+    rgb[..., 2] = y + 2.017 * cb
+    return np.clip(rgb, 0, 255, out=rgb).astype(np.uint8)
+
+
+def _palette_to_rgb(stack: np.ndarray, render: Dict) -> np.ndarray:
+    attributes = Dataset()
+    for keyword in PALETTE_ATTRIBUTES:
+        if keyword in render:
+            setattr(attributes, keyword, render[keyword])
+    rgb = apply_color_lut(stack, attributes)
+    if rgb.dtype != np.uint8:
+        rgb = (rgb >> 8).astype(np.uint8)
+    return rgb
+
+
+def to_display(pixel_array: np.ndarray, render: Dict) -> np.ndarray:
+    """Convert stored pixels to 8-bit display frames: (frames, rows, columns) gray or (..., 3) RGB.
+
+    Monochrome data is windowed (MONOCHROME1 inverted in the same lookup table); color data
+    is converted to RGB over the whole frame stack at once.
+    """
+    photometric = str(render.get("PhotometricInterpretation", "MONOCHROME2")).strip()
+    samples = int(render.get("SamplesPerPixel", 3 if pixel_array.ndim == 4 else 1))
+    stack = frame_stack(pixel_array, 1 if photometric == "PALETTE COLOR" else samples)
+    bits_stored = int(render.get("BitsStored", 8 * pixel_array.dtype.itemsize))
+
+    if photometric in MONOCHROME or (samples == 1 and photometric != "PALETTE COLOR"):
+        return windowing.apply_window(stack, render, invert=photometric == "MONOCHROME1")
+    if photometric == "PALETTE COLOR":
+        return _palette_to_rgb(stack, render)
+    if photometric in ("YBR_FULL", "YBR_FULL_422"):
+        # pydicom upsamples 4:2:2 data, so both arrive as full YBR
+        stack = _to_uint8(stack, bits_stored)
+        return _ybr_full_to_rgb(stack)
+    if photometric in ("YBR_PARTIAL_420", "YBR_PARTIAL_422"):
+        return _ybr_partial_to_rgb(_to_uint8(stack, bits_stored))
+    if photometric not in DECODED_AS_RGB:
+        # Unknown color space: best effort through pydicom
+        stack = convert_color_space(stack, photometric, "RGB")
+    return _to_uint8(stack, bits_stored)
+
+
+def image_to_array(image):
+    """Turn a PIL image into a gray (rows, columns) or RGB (rows, columns, 3) uint8 array, keeping color."""
+    if image.mode in ("1", "L", "LA", "I", "I;16", "I;16B", "I;16L", "F"):
+        if image.mode in ("I", "I;16", "I;16B", "I;16L", "F"):
+            # Scale high bit-depth grayscale down to 8 bits instead of clipping it
+            values = np.asarray(image, dtype=np.float32)
+            high = float(values.max()) or 1.0
+            return (values * (255.0 / high)).astype(np.uint8)
+        return np.asarray(image.convert("L"))
+    return np.asarray(image.convert("RGB"))
+
+
+def bgr_frames_to_array(frames) -> np.ndarray:
+    """Stack OpenCV BGR frames into RGB, or gray when all channels (nearly) match."""
+    cv2 = codec_loader.cv2()
+    stack = np.stack(frames, axis=0)
+    frames_count, rows, columns, _ = stack.shape
+    # One OpenCV call over the stack viewed as a single tall image
+    tall = stack.reshape(frames_count * rows, columns, 3)
+
+    if _is_gray(stack):
+        return cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY).reshape(frames_count, rows, columns)
+    return cv2.cvtColor(tall, cv2.COLOR_BGR2RGB).reshape(stack.shape)
+
+
+def _is_gray(stack: np.ndarray) -> bool:
+    """Whether every pixel's channels are within GRAY_TOLERANCE, so thin colored overlays count.
+
+    Checked frame by frame, stopping at the first frame with a color pixel.
+    """
+    for frame in stack:
+        frame = frame.astype(np.int16)
+        if np.abs(frame[..., 0] - frame[..., 1]).max() > GRAY_TOLERANCE or \
+                np.abs(frame[..., 0] - frame[..., 2]).max() > GRAY_TOLERANCE:
+            return False
+    return True
+
+
+def set_pixel_data(dicom, pixel_array: np.ndarray, color: bool):
+    """Fill the Image Pixel module of a dataset from a gray or RGB uint8 array (single or multi-frame)."""
+    dicom.Rows, dicom.Columns = pixel_array.shape[-3:-1] if color else pixel_array.shape[-2:]
+    dicom.SamplesPerPixel = 3 if color else 1
+    dicom.PhotometricInterpretation = "RGB" if color else "MONOCHROME2"
+    if color:
+        dicom.PlanarConfiguration = 0
+    dicom.BitsAllocated = 8
+    dicom.BitsStored = 8
+    dicom.HighBit = 7
+    dicom.PixelRepresentation = 0
+    dicom.PixelData = np.ascontiguousarray(pixel_array).tobytes()
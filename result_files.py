@@ -0,0 +1,177 @@
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+
+import encoders
+
+CHUNK_SIZE = 256 * 1024
+# Cache lifetime of content-addressed outputs; other outputs are always revalidated
+MAX_AGE = int(os.getenv("DICOM_RESULT_MAX_AGE", 86400))
+# Internal nginx location mapped to the storage root, e.g. /_results/; empty serves files from the API
+ACCEL_PREFIX = os.getenv("DICOM_RESULT_ACCEL_PREFIX", "")
+
+# "<request hash>/output.<format>" keys from coalesced conversions (see spooled_to_format)
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{16}/")
+
+
+class RangeNotSatisfiable(ValueError):
+    """The Range header lies outside the file."""
+
+
+def media_type_for(path: str) -> str:
+    extension = os.path.splitext(path)[1][1:].lower()
+    if extension in encoders.ENCODERS:
+        return encoders.ENCODERS[extension].media_type
+    if extension == "dcm":
+        return "application/dicom"
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def etag_for(key: str, stat: os.stat_result) -> str:
+    """Strong ETag from the file's mtime and size, prefixed with the input/parameter hash of content-addressed keys.
+
+    Outputs are replaced atomically, so any rewrite (a re-conversion after the coalescing TTL) changes
+    the mtime; the validator never claims two writes are identical without looking at the file.
+    """
+    file_tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    if CONTENT_ADDRESSED.match(key):
+        return f'"{key[:16]}-{file_tag}"'
+    return f'"{file_tag}"'
+
+
+def _http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """If-None-Match (weak comparison), or If-Modified-Since when no If-None-Match is sent."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    since = _http_date(headers.get("if-modified-since", ""))
+    return since is not None and int(mtime) <= since
+
+
+def parse_range(headers: Mapping[str, str], size: int, etag: str, mtime: float) -> Optional[Tuple[int, int]]:
+    """The requested byte range as inclusive (start, end), or None to send the whole file.
+
+    Multiple ranges, other units and malformed headers get the whole file, as RFC 9110 allows;
+    a stale If-Range validator does too.
+    """
+    header = headers.get("range")
+    if not header:
+        return None
+    if_range = headers.get("if-range")
+    if if_range:
+        if if_range.startswith(("\"", "W/")):
+            # If-Range needs a strong match
+            if if_range != etag:
+                return None
+        elif _http_date(if_range) != int(mtime):
+            return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start is None:
+        # Suffix range: the last N bytes
+        if not end or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - end), size - 1
+    end = size - 1 if end is None else min(end, size - 1)
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """Send a file or one byte range of it, read in CHUNK_SIZE pieces off the event loop.
+
+    Not the ASGI `http.response.pathsend` extension: the auth middleware (a BaseHTTPMiddleware)
+    only passes `http.response.body` messages. Behind nginx, DICOM_RESULT_ACCEL_PREFIX hands
+    the file to nginx's sendfile instead.
+    """
+
+    def __init__(self, path: str, headers: Dict[str, str], status_code: int = 200, offset: int = 0,
+                 count: Optional[int] = None, send_body: bool = True):
+        self.path = path
+        self.status_code = status_code
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.count
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.offset)
+            while True:
+                chunk = await file.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if remaining is not None:
+                    remaining -= len(chunk)
+                more_body = bool(chunk) and remaining != 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not more_body:
+                    break
+
+
+def file_response(key: str, path: str, request_headers: Mapping[str, str], send_body: bool = True) -> Response:
+    """Answer a GET or HEAD for a stored output with validators, 304, 206 or 416 as the request calls for."""
+    stat = os.stat(path)
+    etag = etag_for(key, stat)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+        "cache-control": f"public, max-age={MAX_AGE}" if CONTENT_ADDRESSED.match(key) else "no-cache",
+    }
+    if not_modified(request_headers, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-type"] = media_type_for(path)
+    filename = os.path.basename(path)
+    if quote(filename) != filename:
+        headers["content-disposition"] = f"inline; filename*=utf-8''{quote(filename)}"
+    else:
+        headers["content-disposition"] = f'inline; filename="{filename}"'
+    if ACCEL_PREFIX:
+        # nginx serves the bytes (sendfile, ranges) from its internal location
+        # A URI, so the key is percent-encoded (non-ASCII, spaces, "#" and "?")
+        headers["x-accel-redirect"] = ACCEL_PREFIX.rstrip("/") + "/" + quote(key)
+        return Response(headers=headers)
+
+    try:
+        byte_range = parse_range(request_headers, stat.st_size, etag, stat.st_mtime)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "content-range": f"bytes */{stat.st_size}"})
+    if byte_range is None:
+        headers["content-length"] = str(stat.st_size)
+        return FileRangeResponse(path, headers, send_body=send_body)
+
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["content-length"] = str(end - start + 1)
+    return FileRangeResponse(path, headers, status_code=206, offset=start, count=end - start + 1,
+                             send_body=send_body)
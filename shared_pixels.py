@@ -0,0 +1,127 @@
+import contextlib
+import logging
+import os
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Segment names carry the owner's PID so stale segments can be found after a crash
+SEGMENT_PREFIX = "dicomapi"
+SHM_DIR = "/dev/shm"
+
+# Arrays above this size go to a memory-mapped file instead of /dev/shm, which is
+# only 64 MB by default inside Docker containers
+SHM_MAX_BYTES = int(os.getenv("DICOM_SHM_MAX_BYTES", 256 * 1024 * 1024))
+MMAP_DIR = os.getenv("DICOM_MMAP_DIR") or tempfile.gettempdir()
+
+
+@dataclass
+class PixelDescriptor:
+    """Small, picklable handle to a pixel array living in shared memory or a memory-mapped file."""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    backend: str = "shm"  # "shm" or "mmap"
+    # DICOM attributes needed to render the pixels (windowing, rescale, photometric)
+    render: Dict = field(default_factory=dict)
+
+
+def _segment_name() -> str:
+    return f"{SEGMENT_PREFIX}_{os.getpid()}_{uuid.uuid4().hex[:12]}"
+
+
+@contextlib.contextmanager
+def share_array(array: np.ndarray, render: Optional[Dict] = None):
+    """Copy an array into a shared segment once and yield its descriptor.
+
+    The creating process owns the segment: it is unlinked when the block exits,
+    whether the worker succeeded, raised or died.
+    """
+    array = np.ascontiguousarray(array)
+    name = _segment_name()
+    backend = "shm" if array.nbytes <= SHM_MAX_BYTES else "mmap"
+    descriptor = PixelDescriptor(name, array.shape, array.dtype.str, backend, render or {})
+
+    if backend == "shm":
+        segment = shared_memory.SharedMemory(name=name, create=True, size=array.nbytes)
+        try:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            yield descriptor
+        finally:
+            segment.close()
+            segment.unlink()
+    else:
+        path = os.path.join(MMAP_DIR, name)
+        try:
+            mapped = np.memmap(path, dtype=array.dtype, mode="w+", shape=array.shape)
+            mapped[...] = array
+            mapped.flush()
+            del mapped
+            yield descriptor
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+@contextlib.contextmanager
+def attach_array(descriptor: PixelDescriptor):
+    """Yield a read-only NumPy view of a shared array without copying it."""
+    if descriptor.backend == "mmap":
+        array = np.memmap(os.path.join(MMAP_DIR, descriptor.name), dtype=descriptor.dtype, mode="r",
+                          shape=descriptor.shape)
+        try:
+            yield array
+        finally:
+            del array
+        return
+
+    segment = shared_memory.SharedMemory(name=descriptor.name)
+    array = np.ndarray(descriptor.shape, dtype=descriptor.dtype, buffer=segment.buf)
+    array.flags.writeable = False
+    try:
+        yield array
+    finally:
+        # The view must be gone before the buffer can be released
+        del array
+        try:
+            segment.close()
+        except BufferError:
+            # A traceback still references the view; the mapping goes away with it
+            pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale_segments():
+    """Remove segments left behind by processes that died without cleaning up."""
+    removed = 0
+    for directory in {SHM_DIR, MMAP_DIR}:
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.listdir(directory):
+            parts = entry.split("_")
+            if len(parts) != 3 or parts[0] != SEGMENT_PREFIX or not parts[1].isdigit():
+                continue
+            if _pid_alive(int(parts[1])):
+                continue
+            try:
+                os.remove(os.path.join(directory, entry))
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        logging.info(f"Removed {removed} stale shared pixel segments")
+    return removed
@@ -0,0 +1,231 @@
+import contextlib
+import io
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+from urllib.parse import quote
+
+from auth_utils import create_result_signature
+
+# Multipart uploads need parts of at least 5 MiB (except the last one)
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_URL_EXPIRES = 3600
+
+
+class LocalStorage:
+    """Store conversion outputs on the local filesystem."""
+
+    def __init__(self, root: str, base_url: str = "/results", url_expires: int = DEFAULT_URL_EXPIRES):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.url_expires = url_expires
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid result key: {key}")
+        return path
+
+    @contextlib.contextmanager
+    def open_writer(self, key: str):
+        """Yield a binary file for the output; it becomes visible only once fully written."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    @contextlib.contextmanager
+    def local_file(self, key: str):
+        """Yield a local path for encoders that can only write to a named, seekable file."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Keep the extension so encoders that pick a container from it still work
+        fd, partial_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".part" + os.path.splitext(path)[1]
+        )
+        os.close(fd)
+        try:
+            yield partial_path
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path_for(key))
+
+    def location(self, key: str) -> str:
+        return self.path_for(key)
+
+    def url_for(self, key: str) -> str:
+        expires = int(time.time()) + self.url_expires
+        signature = create_result_signature(key, expires)
+        # Signed over the plain key; the middleware checks it against the decoded request path
+        return f"{self.base_url}/{quote(key)}?expires={expires}&signature={signature}"
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """Write-only file object that streams into an S3 multipart upload."""
+
+    def __init__(self, client, bucket: str, key: str, part_size: int = DEFAULT_PART_SIZE, content_type: str = None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        size = memoryview(data).nbytes
+        self.buffer += data
+        self.position += size
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return size
+
+    def _upload_part(self, body: bytes):
+        if self.upload_id is None:
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **extra)
+            self.upload_id = response["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def complete(self):
+        """Flush the remaining bytes and finish the upload."""
+        if self.upload_id is None:
+            # Small output: a single PUT is cheaper than a multipart round trip
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **extra)
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self.buffer = bytearray()
+
+
+class S3Storage:
+    """Store conversion outputs in an S3-compatible object store (AWS S3, MinIO, Ceph, ...)."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, part_size: int = DEFAULT_PART_SIZE,
+                 url_expires: int = DEFAULT_URL_EXPIRES, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.endpoint_url = endpoint_url
+        self.part_size = part_size
+        self.url_expires = url_expires
+        self._client = client
+        # boto3 clients are not fork-safe; forked conversion workers build their own
+        os.register_at_fork(after_in_child=self._reset_client)
+
+    def _reset_client(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The S3 storage backend requires boto3 (pip install boto3).")
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @contextlib.contextmanager
+    def open_writer(self, key: str):
+        """Yield a file object whose writes are streamed to the bucket as multipart parts."""
+        content_type = mimetypes.guess_type(key)[0]
+        writer = S3MultipartWriter(self.client, self.bucket, self.object_key(key), self.part_size, content_type)
+        try:
+            yield writer
+            writer.complete()
+        except BaseException:
+            writer.abort()
+            raise
+
+    @contextlib.contextmanager
+    def local_file(self, key: str):
+        """Yield a local scratch path and upload it once the encoder has finished."""
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            yield path
+            with open(path, "rb") as f, self.open_writer(key) as writer:
+                shutil.copyfileobj(f, writer, self.part_size)
+        finally:
+            os.remove(path)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self.object_key(key)}"
+
+    def url_for(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.object_key(key)}, ExpiresIn=self.url_expires
+        )
+
+
+def create_storage(default_root: str):
+    """Create the output storage backend configured through environment variables."""
+    backend = os.getenv("DICOM_STORAGE_BACKEND", "local").lower()
+    url_expires = int(os.getenv("DICOM_RESULT_URL_EXPIRES", DEFAULT_URL_EXPIRES))
+
+    if backend == "s3":
+        bucket = os.getenv("DICOM_S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("DICOM_S3_BUCKET must be set when DICOM_STORAGE_BACKEND=s3.")
+        logging.info(f"Using S3 output storage: bucket={bucket}")
+        return S3Storage(
+            bucket,
+            prefix=os.getenv("DICOM_S3_PREFIX", ""),
+            endpoint_url=os.getenv("DICOM_S3_ENDPOINT_URL") or None,
+            part_size=int(os.getenv("DICOM_S3_PART_SIZE", DEFAULT_PART_SIZE)),
+            url_expires=url_expires,
+        )
+    if backend == "local":
+        root = os.getenv("DICOM_STORAGE_ROOT") or default_root
+        logging.info(f"Using local output storage: {root}")
+        return LocalStorage(root, base_url=os.getenv("DICOM_RESULT_BASE_URL", "/results"), url_expires=url_expires)
+
+    raise RuntimeError(f"Unsupported storage backend: {backend}")
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Iterable, Optional
+
+from fastapi.responses import StreamingResponse
+
+# Seconds between progress events while no result arrives, so proxies and clients see a live stream
+HEARTBEAT_SECONDS = float(os.getenv("DICOM_STREAM_HEARTBEAT", 10))
+
+STREAM_MODES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+_DONE = object()
+
+
+def negotiate_mode(stream: Optional[str], accept: str = "") -> Optional[str]:
+    """Pick the streaming mode from ?stream= or the Accept header; None keeps the plain JSON response."""
+    if stream:
+        if stream not in STREAM_MODES:
+            raise ValueError(f"Unknown stream mode: {stream}. Available: {list(STREAM_MODES)}")
+        return stream
+    for mode, media_type in STREAM_MODES.items():
+        if media_type in accept:
+            return mode
+    return None
+
+
+def _format(mode: str, event: str, data: dict) -> str:
+    if mode == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+def _produce(results: Iterable, events: queue.Queue, cancelled: threading.Event):
+    try:
+        for result in results:
+            events.put(("result", result))
+            if cancelled.is_set():
+                logging.info("Client went away; stopping the streamed batch")
+                break
+    except Exception as e:
+        logging.error(f"Streamed batch failed: {str(e)}")
+        events.put(("error", {"error": str(e)}))
+    finally:
+        events.put(_DONE)
+
+
+def _events(results: Iterable, total: Optional[int], mode: str):
+    events = queue.Queue()
+    cancelled = threading.Event()
+    # Work runs in its own thread so heartbeats keep flowing while a slow file converts
+    threading.Thread(target=_produce, args=(results, events, cancelled), daemon=True).start()
+
+    started = time.monotonic()
+    completed = 0
+
+    def progress() -> dict:
+        return {"completed": completed, "total": total, "elapsed_seconds": round(time.monotonic() - started, 1)}
+
+    try:
+        yield _format(mode, "progress", progress())
+        while True:
+            try:
+                item = events.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield _format(mode, "progress", progress())
+                continue
+            if item is _DONE:
+                break
+            event, data = item
+            if event == "result":
+                completed += 1
+            yield _format(mode, event, data)
+        yield _format(mode, "done", progress())
+    finally:
+        # Also reached when the client disconnects mid-stream
+        cancelled.set()
+
+
+def stream_results(results: Iterable, mode: str, total: Optional[int] = None) -> StreamingResponse:
+    """Stream each result as soon as it is produced, as NDJSON lines or Server-Sent Events.
+
+    Events: `progress` (on start and every HEARTBEAT_SECONDS without a result), `result`
+    (one per item, the same object the JSON response would list), `error`, and a final `done`.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(_events(results, total, mode), media_type=STREAM_MODES[mode], headers=headers)
@@ -1,5 +1,8 @@
 import requests
+import io
+import json
 import os
+import zipfile
 
 # Define the API Base URL
 API_BASE_URL = "http://127.0.0.1:8000"
@@ -125,6 +128,83 @@ def test_convert_to_dicom_batch(token, file_paths, formats, patient_name, patien
         print("Convert-to-DICOM batch endpoint failed:", response.status_code, response.json())
 
 
+def test_convert_batch_stream(token, file_paths, formats):
+    """Test the /convert-batch endpoint with ?stream=ndjson (one event per output as it completes)."""
+    url = f"{API_BASE_URL}/convert-batch"
+    headers = {"Authorization": f"Bearer {token}"}
+    files = [("files", (os.path.basename(fp), open(fp, "rb"))) for fp in file_paths]
+    data = [("formats", fmt) for fmt in formats]
+
+    with requests.post(url, headers=headers, files=files, data=data, params={"stream": "ndjson"},
+                       stream=True) as response:
+        if response.status_code != 200:
+            print("Streaming batch convert failed:", response.status_code, response.text)
+            return
+        events = [json.loads(line) for line in response.iter_lines() if line]
+
+    results = [event for event in events if event["event"] == "result"]
+    print(f"Streaming batch convert: {len(results)} results of {len(file_paths) * len(formats)}, "
+          f"last event: {events[-1]['event'] if events else None}")
+    for result in results:
+        print("Result:", result)
+
+
+def test_convert_batch_archive(token, file_paths, formats):
+    """Test the /convert-batch-archive endpoint with the files zipped into one study archive."""
+    url = f"{API_BASE_URL}/convert-batch-archive"
+    headers = {"Authorization": f"Bearer {token}"}
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for fp in file_paths:
+            zf.write(fp, arcname=f"study/{os.path.basename(fp)}")
+    archive.seek(0)
+    files = {"file": ("study.zip", archive, "application/zip")}
+    data = [("formats", fmt) for fmt in formats]
+
+    response = requests.post(url, headers=headers, files=files, data=data)
+
+    if response.status_code == 200:
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+        results = [event for event in events if event["event"] == "result"]
+        print(f"Archive convert endpoint successful! {len(results)} members of {len(file_paths)}")
+        for result in results:
+            print("Result:", result)
+    else:
+        print("Archive convert endpoint failed:", response.status_code, response.text)
+
+
+def test_results(token, file_path, format):
+    """Test /results: signed download, byte range and conditional request (304) of a converted output."""
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.post(f"{API_BASE_URL}/convert", headers=headers, files={"file": open(file_path, "rb")},
+                             data={"format": format})
+    if response.status_code != 200:
+        print("Convert for /results failed:", response.status_code, response.json())
+        return
+    url = response.json()["url"]
+    if url.startswith("/"):
+        url = f"{API_BASE_URL}{url}"
+
+    # The signed URL needs no Authorization header
+    full = requests.get(url)
+    if full.status_code != 200:
+        print("Results download failed:", full.status_code, full.text)
+        return
+    print(f"Results download successful! {len(full.content)} bytes, ETag {full.headers.get('etag')}")
+
+    partial = requests.get(url, headers={"Range": "bytes=0-99"})
+    if partial.status_code == 206 and partial.content == full.content[:100]:
+        print("Results range request successful!", partial.headers.get("content-range"))
+    else:
+        print("Results range request failed:", partial.status_code)
+
+    cached = requests.get(url, headers={"If-None-Match": full.headers.get("etag", "")})
+    if cached.status_code == 304:
+        print("Results conditional request successful! (304 Not Modified)")
+    else:
+        print("Results conditional request failed:", cached.status_code)
+
+
 
 
 
@@ -186,3 +266,19 @@ if __name__ == "__main__":
     # Test batch convert-to-DICOM endpoint
     print("\nTesting /convert-to-dicom-batch endpoint...")
     test_convert_to_dicom_batch(token ,test_NON_DICOM, test_formats, test_patient_name, test_patient_id)
+
+    # Test PDF to DICOM (stored as Encapsulated PDF)
+    print("\nTesting /convert-to-dicom endpoint with a PDF...")
+    test_convert_to_dicom(token, testPDF_file, "pdf", test_patient_name, test_patient_id)
+
+    # Test streamed batch conversion
+    print("\nTesting /convert-batch endpoint with ?stream=ndjson...")
+    test_convert_batch_stream(token, test_DICOMfiles, ["jpeg", "png"])
+
+    # Test archive conversion
+    print("\nTesting /convert-batch-archive endpoint...")
+    test_convert_batch_archive(token, test_DICOMfiles, ["jpeg", "png"])
+
+    # Test result download
+    print("\nTesting /results endpoint...")
+    test_results(token, test_DICOMfile, "png")
@@ -0,0 +1,193 @@
+import functools
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from pydicom.dataset import Dataset
+from pydicom.multival import MultiValue
+from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut
+
+# Named (center, width) presets in Hounsfield units
+WINDOW_PRESETS = {
+    "lung": (-600, 1500),
+    "mediastinum": (50, 350),
+    "soft_tissue": (40, 400),
+    "abdomen": (60, 400),
+    "liver": (30, 150),
+    "bone": (400, 1800),
+    "brain": (40, 80),
+    "subdural": (75, 215),
+    "stroke": (40, 40),
+}
+
+# Percentiles of the pixel histogram used for automatic windowing
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+
+
+def window_request(center: Optional[float] = None, width: Optional[float] = None, preset: Optional[str] = None,
+                   auto: bool = False) -> Dict:
+    """Validate the windowing options of a request and resolve presets to center/width."""
+    if preset:
+        if center is not None or width is not None:
+            raise ValueError("Give either window_preset or window_center/window_width, not both.")
+        if preset not in WINDOW_PRESETS:
+            raise ValueError(f"Unknown window preset: {preset}. Available: {sorted(WINDOW_PRESETS)}")
+        center, width = WINDOW_PRESETS[preset]
+    if (center is None) != (width is None):
+        raise ValueError("window_center and window_width must be given together.")
+    if width is not None and width <= 0:
+        # Sub-unit widths are fine: real-valued data (e.g. 0..1 maps) needs them
+        raise ValueError("window_width must be greater than 0.")
+    if center is not None:
+        return {"window_center": float(center), "window_width": float(width)}
+    if auto:
+        return {"auto_window": True}
+    return {}
+
+
+def _first(value):
+    """Return the first value of a possibly multi-valued attribute."""
+    return value[0] if isinstance(value, (MultiValue, list, tuple)) else value
+
+
+def _attributes(render: Dict) -> Dataset:
+    dataset = Dataset()
+    for keyword, value in render.items():
+        if keyword[0].isupper():
+            setattr(dataset, keyword, value)
+    return dataset
+
+
+def _raw_values(dtype: np.dtype) -> np.ndarray:
+    """Every stored value of an 8/16-bit dtype, ordered by its unsigned bit pattern."""
+    unsigned = np.dtype(f"u{dtype.itemsize}")
+    return np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+
+
+@functools.lru_cache(maxsize=8)
+def _sorted_values(dtype_str: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Stored values in ascending order and the bit-pattern index of each (they differ for signed data)."""
+    values = _raw_values(np.dtype(dtype_str))
+    order = np.argsort(values, kind="stable")
+    return values[order].astype(np.float64), order
+
+
+@functools.lru_cache(maxsize=64)
+def linear_window_lut(dtype_str: str, slope: float, intercept: float, center: float, width: float,
+                      function: str = "LINEAR", invert: bool = False) -> np.ndarray:
+    """Compile modality rescale + VOI window into an 8-bit lookup table over every stored value.
+
+    Cached, so the table is built once per series/window and shared by every frame and batch item.
+    """
+    values = _raw_values(np.dtype(dtype_str)).astype(np.float64) * slope + intercept
+    return _window_to_uint8(values, center, width, function, invert)
+
+
+def _window_to_uint8(values: np.ndarray, center: float, width: float, function: str = "LINEAR",
+                     invert: bool = False) -> np.ndarray:
+    # Window functions from DICOM PS3.3 C.11.2.1.2
+    if function == "SIGMOID":
+        out = 255.0 / (1.0 + np.exp(-4.0 * (values - center) / width))
+    elif function == "LINEAR_EXACT":
+        out = ((values - center) / width + 0.5) * 255.0
+    else:
+        width = max(width, 1.0)
+        if width == 1.0:
+            out = np.where(values < center - 0.5, 0.0, 255.0)
+        else:
+            out = ((values - (center - 0.5)) / (width - 1.0) + 0.5) * 255.0
+    out = np.clip(out, 0, 255)
+    if invert:
+        out = 255 - out
+    return np.rint(out).astype(np.uint8)
+
+
+def _sequence_lut(dtype: np.dtype, render: Dict, invert: bool) -> np.ndarray:
+    """Compile Modality/VOI LUT Sequences into an 8-bit lookup table by running pydicom once over all values."""
+    attributes = _attributes(render)
+    values = apply_voi_lut(apply_modality_lut(_raw_values(dtype), attributes), attributes)
+    if "VOILUTSequence" in render:
+        bits = int(render["VOILUTSequence"][0].LUTDescriptor[2]) or 16
+        low, high = 0, 2 ** bits - 1
+    else:
+        low, high = float(values.min()), float(values.max())
+    out = np.clip((values.astype(np.float64) - low) * (255.0 / max(high - low, 1)), 0, 255)
+    if invert:
+        out = 255 - out
+    return np.rint(out).astype(np.uint8)
+
+
+def _integral(dtype: np.dtype, slope: float, intercept: float) -> bool:
+    """Whether modality values are whole numbers, the unit the LINEAR window function is defined in."""
+    return dtype.kind in "iu" and float(slope).is_integer() and float(intercept).is_integer()
+
+
+def auto_window(pixel_array: np.ndarray, slope: float, intercept: float) -> Tuple[float, float]:
+    """Pick a window from the percentiles of the stored-value histogram (one pass, no float copy)."""
+    low_pct, high_pct = AUTO_WINDOW_PERCENTILES
+    if pixel_array.dtype.itemsize <= 2 and pixel_array.dtype.kind in "iu":
+        unsigned = np.dtype(f"u{pixel_array.dtype.itemsize}")
+        counts = np.bincount(pixel_array.view(unsigned).ravel(), minlength=2 ** (8 * pixel_array.dtype.itemsize))
+        values, order = _sorted_values(pixel_array.dtype.str)
+        cumulative = np.cumsum(counts[order])
+        total = cumulative[-1]
+        low = values[np.searchsorted(cumulative, total * low_pct / 100.0)]
+        high = values[min(np.searchsorted(cumulative, total * high_pct / 100.0), len(values) - 1)]
+    else:
+        low, high = np.percentile(pixel_array, AUTO_WINDOW_PERCENTILES)
+    low, high = low * slope + intercept, high * slope + intercept
+    width = float(high - low)
+    if _integral(pixel_array.dtype, slope, intercept):
+        width = max(width, 1.0)
+    elif width <= 0:
+        # Constant real-valued image: any positive width maps it to mid-gray
+        width = 1.0
+    return float(low + high) / 2.0, width
+
+
+def _significant(value: float) -> float:
+    """Round a window parameter for the LUT cache key, keeping 6 significant digits."""
+    return float(f"{value:.6g}")
+
+
+def apply_window(pixel_array: np.ndarray, render: Dict, invert: bool = False) -> np.ndarray:
+    """Map stored monochrome pixel values to 8-bit display values (inverted for MONOCHROME1 when invert is set).
+
+    Applies the modality LUT (rescale slope/intercept) and the VOI window chosen from, in order:
+    an explicit window_center/window_width, auto_window, the dataset's VOI LUT / window, or an
+    automatic percentile window. Integer data up to 16 bits is mapped with a single np.take.
+    """
+    slope = float(render.get("RescaleSlope", 1) or 1)
+    intercept = float(render.get("RescaleIntercept", 0) or 0)
+    function = str(render.get("VOILUTFunction", "LINEAR")).upper()
+
+    if "window_center" in render:
+        center, width = render["window_center"], render["window_width"]
+    elif render.get("auto_window"):
+        center, width = auto_window(pixel_array, slope, intercept)
+    elif "WindowCenter" in render and "WindowWidth" in render and "VOILUTSequence" not in render \
+            and "ModalityLUTSequence" not in render:
+        center, width = float(_first(render["WindowCenter"])), float(_first(render["WindowWidth"]))
+    elif ("VOILUTSequence" in render or "ModalityLUTSequence" in render) and pixel_array.dtype.itemsize <= 2 \
+            and pixel_array.dtype.kind in "iu":
+        lut = _sequence_lut(pixel_array.dtype, render, invert)
+        unsigned = np.dtype(f"u{pixel_array.dtype.itemsize}")
+        return np.take(lut, pixel_array.view(unsigned))
+    else:
+        center, width = auto_window(pixel_array, slope, intercept)
+
+    if function == "LINEAR" and not _integral(pixel_array.dtype, slope, intercept):
+        # LINEAR assumes whole-number values (width >= 1); real-valued data such as 0..1 parametric
+        # maps or fractional rescale slopes need the exact linear ramp instead
+        function = "LINEAR_EXACT"
+    if pixel_array.dtype.itemsize <= 2 and pixel_array.dtype.kind in "iu":
+        # Rounded to significant digits (not decimals), so sub-unit widths never collapse to 0
+        lut = linear_window_lut(pixel_array.dtype.str, slope, intercept, _significant(center), _significant(width),
+                                function, invert)
+        unsigned = np.dtype(f"u{pixel_array.dtype.itemsize}")
+        return np.take(lut, pixel_array.view(unsigned))
+
+    # Float or 32-bit data: window directly in float32
+    logging.info(f"Windowing {pixel_array.dtype} pixel data without a lookup table")
+    values = pixel_array.astype(np.float32) * np.float32(slope) + np.float32(intercept)
+    return _window_to_uint8(values, center, width, function, invert)